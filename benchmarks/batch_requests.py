@@ -0,0 +1,112 @@
+"""
+Counts document analysis requests per 1,000 forms for several batch sizes, and their size for several payload formats.
+
+The services are replaced by local stand-ins (a fixed detection result and an analyze result with one empty page per
+crop page) so only request counts, payload sizes and local CPU time are measured.
+
+Usage:
+    python -m benchmarks.batch_requests -c 1500.config.yaml -n 200 --batch-sizes 1 5 10 20 50 --payload-formats pdf tiff-g4 tiff-lzw
+"""
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import argparse
+import copy
+import logging
+import math
+import os
+import re
+import time
+
+os.environ.setdefault("VISION_ENDPOINT", "http://localhost/")
+os.environ.setdefault("VISION_KEY", "")
+os.environ.setdefault("FORM_RECOGNIZER_ENDPOINT", "http://localhost/")
+os.environ.setdefault("FORM_RECOGNIZER_KEY", "")
+
+import cv2
+import numpy as np
+from io import BytesIO
+from PIL import Image
+
+import process
+from util import detection
+from util.pipeline import Pipeline
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def synthetic_page(label_boxes):
+    """
+    A white page with a few digit rows below each detected box.
+    """
+    image = np.full((process.PAGE_HEIGHT, process.PAGE_WIDTH, 3), 255, np.uint8)
+    for x, y, w, h in label_boxes.values():
+        cv2.rectangle(image, (x, y), (x+w, y+h), (0, 0, 0), 2)
+        for row in range(3):
+            cv2.putText(image, '12 34', (x+10, y+h+40+row*50), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 2)
+    return image
+
+def detection_result(label_boxes):
+    values = []
+    for label, (x, y, w, h) in label_boxes.items():
+        values.append({'boundingBox': {'x': x, 'y': y, 'w': w, 'h': h}, 'tags': [{'name': label, 'confidence': 0.99}]})
+    return {'customModelResult': {'objectsResult': {'values': values}}}
+
+def count_pdf_pages(pdf_data):
+    return len(re.findall(rb'/Type\s*/Page\b(?!s)', pdf_data))
+
+def count_pages(payload):
+    if payload.startswith(b'%PDF'):
+        return count_pdf_pages(payload)
+    return Image.open(BytesIO(payload)).n_frames
+
+def run(files, config, batch_size, label_boxes):
+    stats = {'requests': 0, 'bytes': 0}
+    image = synthetic_page(label_boxes)
+    success, encoded_image = cv2.imencode('.jpg', image)
+
+    def analyze(pdf_data, model, api_version, features=[]):
+        stats['requests'] += 1
+        stats['bytes'] += len(pdf_data)
+        pages = [{'pageNumber': i+1, 'words': []} for i in range(count_pages(pdf_data))]
+        return {'pages': pages}
+
+    process.rasterize_form = lambda form_file, page_index=0, grayscale=False, encode=True: (image, encoded_image.tobytes())
+    detection.object_detection_rest = lambda image_data, model: detection_result(label_boxes)
+    process.analyze_document_rest = analyze
+
+    start = time.perf_counter()
+    records = list(process.process_records([(file, 0) for file in files], Pipeline(config), 1, batch_size))
+    elapsed = time.perf_counter() - start
+    assert len(records) == len(files)
+    return stats['requests'], stats['bytes'], elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Document analysis requests per 1,000 forms by batch size.')
+    parser.add_argument('-c', '--config', default='1500.config.yaml', help='Form processing config file.')
+    parser.add_argument('-n', '--forms', type=int, default=200, help='Number of synthetic forms per run.')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 5, 10, 20, 50])
+    parser.add_argument('--payload-formats', nargs='+', help='Payload formats to compare (defaults to document_analysis.payload_format).')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    config = process.load_config(args.config)
+    payload_formats = args.payload_formats or [config['document_analysis'].get('payload_format', 'pdf')]
+    labels = sorted({field['cropping']['label'] for field in config['fields']})
+    label_boxes = {label: (100 + (i % 3)*500, 300 + (i // 3)*900, 200, 40) for i, label in enumerate(labels)}
+    files = [f'form_{i}.pdf' for i in range(args.forms)]
+
+    print(f"{'format':>9} {'batch':>6} {'requests':>9} {'req/1000 forms':>15} {'KB/request':>11} {'KB/form':>8} {'seconds':>8}")
+    for payload_format in payload_formats:
+        format_config = copy.deepcopy(config)
+        format_config['document_analysis']['payload_format'] = payload_format
+        for batch_size in args.batch_sizes:
+            batch_size = process.get_batch_size(format_config, batch_size)
+            requests, payload_bytes, elapsed = run(files, format_config, batch_size, label_boxes)
+            per_thousand = math.ceil(requests * 1000 / len(files))
+            print(f"{payload_format:>9} {batch_size:>6} {requests:>9} {per_thousand:>15} {payload_bytes/requests/1024:>11.1f} {payload_bytes/len(files)/1024:>8.1f} {elapsed:>8.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Compares util.pre_processing.denoise with the remove_blobs/remove_hlines chain it replaces.
+
+Runs both over field crops (for example the cropped_*.jpg files written in DEBUG_MODE, or synthetic noisy crops),
+fails when more than --tolerance of the pixels differ and reports the time per crop.
+
+Usage:
+    python -m benchmarks.denoise -i "work/*cropped_*.jpg"
+"""
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import argparse
+
+import numpy as np
+
+from benchmarks.remove_blobs import add_specks, load_crops, measure
+from util.pre_processing import denoise, remove_blobs, remove_hlines
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def denoise_chain(gray, large_blob_area, small_blob_area):
+    cropped = remove_blobs(gray, large_blob_area)
+    cropped = remove_hlines(cropped)
+    cropped = remove_blobs(cropped, small_blob_area)
+    return remove_hlines(cropped)
+
+def main():
+    parser = argparse.ArgumentParser(description='Fused denoise against the remove_blobs/remove_hlines chain.')
+    parser.add_argument('-i', '--input', help='Glob of grayscale crop images (synthetic crops are used when nothing matches).')
+    parser.add_argument('-n', '--count', type=int, default=20, help='Number of synthetic crops.')
+    parser.add_argument('--specks', type=int, default=300, help='Specks added to each crop.')
+    parser.add_argument('--tolerance', type=float, default=0.0, help='Maximum fraction of differing pixels per crop.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    crops = [add_specks(crop, args.specks, rng) for crop in load_crops(args.input, args.count, rng)]
+
+    chain_time, chain_outputs = measure(lambda crop, area: denoise_chain(crop, area, 10), crops, 40, args.repeat)
+    fused_time, fused_outputs = measure(lambda crop, area: denoise(crop, area, 10), crops, 40, args.repeat)
+
+    worst = 0.0
+    for expected, actual in zip(chain_outputs, fused_outputs):
+        assert expected.shape == actual.shape, "shapes differ"
+        worst = max(worst, np.count_nonzero(expected != actual) / expected.size)
+    assert worst <= args.tolerance, f"{worst:.4%} of the pixels differ"
+
+    print(f"{len(crops)} crops, worst pixel difference {worst:.4%}")
+    print(f"chain {chain_time*1000:.2f} ms, fused {fused_time*1000:.2f} ms, {chain_time/fused_time:.1f}x")
+
+if __name__ == '__main__':
+    main()
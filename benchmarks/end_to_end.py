@@ -0,0 +1,205 @@
+"""
+Runs process_forms end to end against the local mock service and reports throughput, CPU time per stage and peak
+memory as JSON, so runs of different commits can be compared without calling Azure.
+
+Forms are the PDFs of --input (a folder or a single PDF), or --forms synthetic pages. Everything but the services is real:
+rasterization, cropping, noise removal, payload encoding, the HTTP clients (rate limiter and retries included) and
+post-processing. The result cache is off. Each report holds the commit it was run on and its settings, and is
+appended to --output as one JSON line; --baseline compares it to the last report of a file with the same settings.
+
+Usage:
+    python -m benchmarks.end_to_end -c 1500.config.yaml -i data/ -w 4 -b 10 --fixtures work/cache
+    python -m benchmarks.end_to_end -n 50 --throttle-rate 0.1 -o work/benchmarks.jsonl --baseline work/benchmarks.jsonl
+"""
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+os.environ.setdefault("VISION_ENDPOINT", "http://localhost/")
+os.environ.setdefault("VISION_KEY", "")
+os.environ.setdefault("VISION_MODEL", "benchmark")
+os.environ.setdefault("FORM_RECOGNIZER_ENDPOINT", "http://localhost/")
+os.environ.setdefault("FORM_RECOGNIZER_KEY", "")
+
+from PIL import Image
+
+import process
+from benchmarks.batch_requests import synthetic_page
+from benchmarks.mock_service import DEFAULT_ANALYZE_LATENCY, DEFAULT_LATENCY, DEFAULT_THROTTLE_RETRY_AFTER, Fixtures, MockService, label_boxes
+from util import computervision_api, http_client
+from util.cache import disable_cache
+from util.rate_limit import configure_rate_limits, get_throttling_stats
+
+# globals
+# settings that must be equal for two reports to be compared
+COMPARED_SETTINGS = ('config', 'input', 'forms', 'pages', 'workers', 'batch_size', 'latency', 'analyze_latency', 'throttle_rate', 'retry_after', 'fixtures')
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def git_commit():
+    """
+    Returns the commit of the working tree and whether it has uncommitted changes, (None, None) outside of git.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout.strip() != ''
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def synthetic_forms(config, count, folder):
+    """
+    Writes count single page PDFs of a synthetic form (the labels of the config at fixed boxes) to a folder.
+    """
+    image = Image.fromarray(synthetic_page(label_boxes(config)))
+    files = []
+    for i in range(count):
+        path = os.path.join(folder, f'form_{i:05d}.pdf')
+        image.save(path, resolution=200)
+        files.append(path)
+    return files
+
+def peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS; for RUSAGE_CHILDREN it is the largest child
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024*1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run(files, config, settings):
+    """
+    Processes the forms against a mock service and returns the report of the run.
+    """
+    fixtures = Fixtures(settings['fixtures'], label_boxes(config))
+    service = MockService(fixtures, settings['latency'], settings['analyze_latency'], settings['throttle_rate'],
+                          settings['retry_after'], settings['seed']).start()
+    os.environ['FORM_RECOGNIZER_ENDPOINT'] = service.url
+    computervision_api.VISION_ENDPOINT = service.url
+    disable_cache()
+    configure_rate_limits(max_concurrency=http_client.HTTP_POOL_SIZE)
+
+    before = os.times()
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            summary = process.process_forms(files, config, settings['workers'], settings['batch_size'],
+                                            os.path.join(output_dir, 'output.csv'), pages=settings['pages'])
+    finally:
+        service.stop()
+    after = os.times()
+
+    commit, dirty = git_commit()
+    elapsed = summary['elapsed']
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': settings,
+        'forms': summary['forms'],
+        'elapsed': elapsed,
+        'forms_per_second': round(summary['forms'] / elapsed, 3) if elapsed > 0 else 0.0,
+        'cpu': {
+            'main': round(after.user - before.user + after.system - before.system, 3),
+            'workers': round(after.children_user - before.children_user + after.children_system - before.children_system, 3),
+            'stages': {stage: stats['cpu'] for stage, stats in summary['stages'].items()}
+        },
+        'peak_rss_mb': {'main': peak_rss_mb(resource.RUSAGE_SELF), 'workers': peak_rss_mb(resource.RUSAGE_CHILDREN)},
+        'stages': summary['stages'],
+        'api_calls_per_form': summary['api_calls_per_form'],
+        'throttling': get_throttling_stats(),
+        'service': service.stats,
+        'replayed': fixtures.replayed
+    }
+
+def find_baseline(path, settings):
+    """
+    Returns the last report of a JSONL file run with the same settings, None when there is none.
+    """
+    if not os.path.exists(path):
+        return None
+    baseline = None
+    with open(path) as f:
+        for line in f:
+            report = json.loads(line)
+            if all(report['settings'].get(name) == settings.get(name) for name in COMPARED_SETTINGS):
+                baseline = report
+    return baseline
+
+def compare(report, baseline):
+    """
+    Prints the changes of throughput, stage CPU time and peak memory from a baseline report.
+    """
+    def change(new, old):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print(f"Compared to {baseline['commit'] or 'unknown commit'}{' (dirty)' if baseline['dirty'] else ''} of {baseline['timestamp']}:")
+    print(f"  forms/s   {baseline['forms_per_second']:>10.3f} -> {report['forms_per_second']:>10.3f}  {change(report['forms_per_second'], baseline['forms_per_second'])}")
+    for stage, cpu in report['cpu']['stages'].items():
+        old = baseline['cpu']['stages'].get(stage, 0.0)
+        print(f"  cpu {stage:<13} {old:>8.3f}s -> {cpu:>8.3f}s  {change(cpu, old)}")
+    for who in ('main', 'workers'):
+        old, new = baseline['peak_rss_mb'][who], report['peak_rss_mb'][who]
+        print(f"  rss {who:<13} {old:>7.1f}MB -> {new:>7.1f}MB  {change(new, old)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end pipeline benchmark against a local mock of the services.')
+    parser.add_argument('-c', '--config', default='1500.config.yaml', help='Form processing config file.')
+    parser.add_argument('-i', '--input', help='Folder of the sample PDFs or a single PDF (defaults to synthetic forms).')
+    parser.add_argument('-n', '--forms', type=int, default=50, help='Number of synthetic forms, when no input is given.')
+    parser.add_argument('-p', '--pages', default=process.DEFAULT_PAGES, help="Pages of each pdf processed as forms (see process.py).")
+    parser.add_argument('-w', '--workers', type=int, default=4)
+    parser.add_argument('-b', '--batch-size', type=int, help='Forms per document analysis request (defaults to the config).')
+    parser.add_argument('--fixtures', help='Folder of recorded results, e.g. the result cache of a real run (work/cache).')
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help='Seconds before every response of the mock service.')
+    parser.add_argument('--analyze-latency', type=float, default=DEFAULT_ANALYZE_LATENCY, help='Seconds before an analyze operation succeeds.')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of the requests answered with a 429.')
+    parser.add_argument('--retry-after', type=float, default=DEFAULT_THROTTLE_RETRY_AFTER, help='Retry-After of the 429 responses (seconds).')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the 429 draws.')
+    parser.add_argument('-o', '--output', help='Append the report to this JSONL file.')
+    parser.add_argument('--baseline', help='JSONL file of previous reports to compare with (the last one with the same settings).')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    config = process.load_config(args.config)
+    settings = {
+        'config': args.config,
+        'input': args.input,
+        'forms': None if args.input else args.forms,
+        'pages': args.pages,
+        'workers': args.workers,
+        'batch_size': process.get_batch_size(config, args.batch_size),
+        'latency': args.latency,
+        'analyze_latency': args.analyze_latency,
+        'throttle_rate': args.throttle_rate,
+        'retry_after': args.retry_after,
+        'seed': args.seed,
+        'fixtures': args.fixtures
+    }
+    baseline = find_baseline(args.baseline, settings) if args.baseline else None
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        files = process.get_files(args.input) if args.input else synthetic_forms(config, args.forms, corpus_dir)
+        report = run(files, config, settings)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(report) + "\n")
+    if baseline is not None:
+        compare(report, baseline)
+
+if __name__ == '__main__':
+    main()
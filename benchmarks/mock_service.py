@@ -0,0 +1,257 @@
+"""
+A local stand-in for the Vision and Document Intelligence REST endpoints, for offline benchmarks.
+
+It answers the object detection request, the analyze request (202 with an Operation-Location) and the result polls
+the way the services do, after a configurable latency, and can throttle a share of the requests with 429 responses.
+Results are replayed from recorded fixtures (see Fixtures) or made up from the config when none match.
+
+Usage (standalone, point VISION_ENDPOINT and FORM_RECOGNIZER_ENDPOINT at the printed url):
+    python -m benchmarks.mock_service -c 1500.config.yaml --fixtures work/cache --port 8765
+"""
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.batch_requests import count_pages, detection_result
+from util.cache import ResultCache
+
+# globals
+DEFAULT_LATENCY = 0.2
+DEFAULT_ANALYZE_LATENCY = 3.0
+DEFAULT_THROTTLE_RETRY_AFTER = 1.0
+# word rows of the made up analysis pages, in inches from the top left corner of the crop
+SYNTHETIC_WORDS = [
+    {'content': '12', 'polygon': [0.1, 0.1, 0.3, 0.1, 0.3, 0.2, 0.1, 0.2], 'confidence': 0.99},
+    {'content': '34', 'polygon': [0.4, 0.1, 0.6, 0.1, 0.6, 0.2, 0.4, 0.2], 'confidence': 0.99}
+]
+
+# -----------------------------
+#   CLASSES
+# -----------------------------
+
+class Fixtures:
+    """
+    Recorded objectsResult and analyzeResult JSON replayed by the mock service.
+
+    The fixtures folder can be the result cache of a real run (work/cache): its files are named after the hash of
+    the request, so a request identical to a recorded one gets its recorded result. Any other JSON file in the folder
+    is used too. Requests without a recorded result get the detection results in turn, and an analysis made of the
+    recorded pages, in turn and renumbered to the pages of the request. Without fixtures, detection results place the
+    labels of the config at fixed boxes and every analysis page holds the same two words.
+
+    replayed counts the requests that got their recorded result, by endpoint.
+    """
+
+    def __init__(self, fixtures_dir=None, label_boxes=None):
+        self.recorded = {}
+        self.detections = []
+        self.pages = []
+        self.replayed = {'vision': 0, 'formrec': 0}
+        if fixtures_dir:
+            for root, _, files in os.walk(fixtures_dir):
+                for name in sorted(files):
+                    if name.endswith('.json'):
+                        with open(os.path.join(root, name)) as f:
+                            self.add(name[:-len('.json')], json.load(f))
+        if not self.detections:
+            self.detections.append(detection_result(label_boxes or {}))
+        self._next_detection = itertools.cycle(self.detections)
+        self._next_page = itertools.cycle(self.pages) if self.pages else None
+        self._lock = threading.Lock()
+
+    def add(self, key, result):
+        if 'customModelResult' in result or 'objectsResult' in result:
+            self.detections.append(result)
+        elif 'pages' in result:
+            self.pages.extend(result['pages'])
+        else:
+            return
+        self.recorded[key] = result
+
+    def detection(self, image_data, model, api_version):
+        recorded = self.recorded.get(ResultCache.key("vision", image_data, model, api_version))
+        with self._lock:
+            if recorded is not None:
+                self.replayed['vision'] += 1
+                return recorded
+            return next(self._next_detection)
+
+    def analysis(self, document, model, api_version, features):
+        recorded = self.recorded.get(ResultCache.key("formrec", document, model, api_version, features))
+        pages = []
+        with self._lock:
+            if recorded is not None:
+                self.replayed['formrec'] += 1
+                return recorded
+            for number in range(1, count_pages(document)+1):
+                page = next(self._next_page) if self._next_page is not None else {'unit': 'inch', 'words': SYNTHETIC_WORDS}
+                pages.append({**page, 'pageNumber': number})
+        return {'apiVersion': api_version, 'modelId': model, 'pages': pages}
+
+class MockService:
+    """
+    The mock endpoints, served by a thread of the current process.
+
+    Every response is sent after latency seconds. Analyze operations succeed analyze_latency seconds after their
+    request; the 202 of the request and the polls of a running operation carry the time left as Retry-After, as the
+    service does. A throttle_rate share of the requests (analyze, polls and detection alike) get a 429 with a Retry-After
+    of retry_after seconds instead. Random draws are seeded, so two runs with the same settings get the same 429s for
+    the same sequence of requests.
+
+    Stats: requests received, throttled (429 sent) and operations started, by endpoint.
+    """
+
+    def __init__(self, fixtures, latency=DEFAULT_LATENCY, analyze_latency=DEFAULT_ANALYZE_LATENCY, throttle_rate=0.0,
+                 retry_after=DEFAULT_THROTTLE_RETRY_AFTER, seed=0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.analyze_latency = analyze_latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.operations = {}
+        self.stats = {'vision': {'requests': 0, 'throttled': 0}, 'formrec': {'requests': 0, 'throttled': 0},
+                      'formrec_poll': {'requests': 0, 'throttled': 0}}
+        self.server = None
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self, host='127.0.0.1', port=0):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                service.handle(self, 'POST')
+
+            def do_GET(self):
+                service.handle(self, 'GET')
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def throttled(self, endpoint):
+        with self._lock:
+            self.stats[endpoint]['requests'] += 1
+            if self.throttle_rate > 0 and self.random.random() < self.throttle_rate:
+                self.stats[endpoint]['throttled'] += 1
+                return True
+            return False
+
+    def handle(self, request, method):
+        url = urlparse(request.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        body = request.rfile.read(int(request.headers.get('Content-Length', 0))) if method == 'POST' else b''
+        time.sleep(self.latency)
+
+        if method == 'POST' and url.path.endswith('imageanalysis:analyze'):
+            endpoint = 'vision'
+        elif method == 'POST' and url.path.endswith(':analyze'):
+            endpoint = 'formrec'
+        elif method == 'GET' and '/analyzeResults/' in url.path:
+            endpoint = 'formrec_poll'
+        else:
+            return send(request, 404, {'error': {'code': 'NotFound', 'message': url.path}})
+
+        if self.throttled(endpoint):
+            return send(request, 429, {'error': {'code': '429', 'message': 'Rate limit is exceeded.'}}, {'Retry-After': str(self.retry_after)})
+
+        if endpoint == 'vision':
+            return send(request, 200, self.fixtures.detection(body, query.get('model-name'), query.get('api-version')))
+
+        if endpoint == 'formrec':
+            model = url.path.split('/')[-1][:-len(':analyze')]
+            features = ",".join(sorted(query['features'].split(','))) if 'features' in query else ""
+            result = self.fixtures.analysis(body, model, query.get('api-version'), features)
+            operation_id = uuid.uuid4().hex
+            with self._lock:
+                self.operations[operation_id] = (time.monotonic() + self.analyze_latency, result)
+            location = f"{self.url}formrecognizer/documentModels/{model}/analyzeResults/{operation_id}?api-version={query.get('api-version')}"
+            return send(request, 202, None, {'Operation-Location': location, 'Retry-After': f"{self.analyze_latency:.3f}"})
+
+        operation_id = url.path.split('/')[-1]
+        with self._lock:
+            operation = self.operations.get(operation_id)
+        if operation is None:
+            return send(request, 404, {'error': {'code': 'NotFound', 'message': operation_id}})
+        ready_at, result = operation
+        now = time.monotonic()
+        if now < ready_at:
+            return send(request, 200, {'status': 'running'}, {'Retry-After': f"{ready_at - now:.3f}"})
+        with self._lock:
+            self.operations.pop(operation_id, None)
+        return send(request, 200, {'status': 'succeeded', 'analyzeResult': result})
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def send(request, status, body, headers=None):
+    data = json.dumps(body).encode() if body is not None else b''
+    request.send_response(status)
+    request.send_header('Content-Type', 'application/json')
+    request.send_header('Content-Length', str(len(data)))
+    for name, value in (headers or {}).items():
+        request.send_header(name, value)
+    request.end_headers()
+    request.wfile.write(data)
+
+def label_boxes(config):
+    """
+    The fixed boxes of the labels of a config, as used by the synthetic pages and detection results.
+    """
+    labels = sorted({field['cropping']['label'] for field in config['fields']})
+    return {label: (100 + (i % 3)*500, 300 + (i // 3)*900, 200, 40) for i, label in enumerate(labels)}
+
+def main():
+    import process
+
+    parser = argparse.ArgumentParser(description='Mock Vision and Document Intelligence endpoints.')
+    parser.add_argument('-c', '--config', default='1500.config.yaml', help='Form processing config file (labels of the made up detection results).')
+    parser.add_argument('--fixtures', help='Folder of recorded results, e.g. the result cache of a real run (work/cache).')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help='Seconds before every response.')
+    parser.add_argument('--analyze-latency', type=float, default=DEFAULT_ANALYZE_LATENCY, help='Seconds before an analyze operation succeeds.')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of the requests answered with a 429.')
+    parser.add_argument('--retry-after', type=float, default=DEFAULT_THROTTLE_RETRY_AFTER, help='Retry-After of the 429 responses (seconds).')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config = process.load_config(args.config)
+    service = MockService(Fixtures(args.fixtures, label_boxes(config)), args.latency, args.analyze_latency,
+                          args.throttle_rate, args.retry_after, args.seed).start(port=args.port)
+    logging.info(f"Mock service at {service.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        service.stop()
+
+if __name__ == '__main__':
+    main()
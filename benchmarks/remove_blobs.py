@@ -0,0 +1,96 @@
+"""
+Micro-benchmark of util.pre_processing.remove_blobs against the previous per-label loop.
+
+Runs both implementations over field crops (for example the cropped_*.jpg files written in DEBUG_MODE), checks that
+the outputs are identical and reports the time per crop. Specks can be added to the crops to simulate noisy scans.
+
+Usage:
+    python -m benchmarks.remove_blobs -i "work/*cropped_*.jpg" --specks 300
+"""
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import argparse
+import time
+from glob import glob
+
+import cv2
+import numpy as np
+
+from util.pre_processing import remove_blobs
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def remove_blobs_loop(img, area_threshold):
+    """
+    The previous implementation: clears each small component with a full-image comparison.
+    """
+    _, binary = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=4)
+    for i in range(1, num_labels):
+        if stats[i, cv2.CC_STAT_AREA] < area_threshold:
+            labels[labels == i] = 0
+    new_binary = np.zeros_like(binary)
+    new_binary[labels > 0] = 255
+    new_img = cv2.cvtColor(new_binary, cv2.COLOR_GRAY2BGR)
+    new_img = cv2.bitwise_not(new_img)
+    return new_img
+
+def synthetic_crop(rng, height=390, width=400):
+    crop = np.full((height, width), 255, np.uint8)
+    for row in range(6):
+        cv2.putText(crop, f'{rng.integers(10, 99)} {rng.integers(10, 99)}', (20, 50 + row*60), cv2.FONT_HERSHEY_SIMPLEX, 1.5, 0, 3)
+        cv2.line(crop, (0, 60 + row*60), (width, 60 + row*60), 0, 1)
+    return crop
+
+def add_specks(crop, specks, rng):
+    crop = crop.copy()
+    ys = rng.integers(0, crop.shape[0]-3, specks)
+    xs = rng.integers(0, crop.shape[1]-3, specks)
+    sizes = rng.integers(1, 4, specks)
+    for y, x, size in zip(ys, xs, sizes):
+        crop[y:y+size, x:x+size] = 0
+    return crop
+
+def load_crops(pattern, count, rng):
+    crops = [cv2.imread(file, cv2.IMREAD_GRAYSCALE) for file in sorted(glob(pattern))] if pattern else []
+    crops = [crop for crop in crops if crop is not None]
+    if len(crops) == 0:
+        crops = [synthetic_crop(rng) for _ in range(count)]
+    return crops
+
+def measure(fn, crops, area_threshold, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [fn(crop, area_threshold) for crop in crops]
+        best = min(best, time.perf_counter() - start)
+    return best / len(crops), outputs
+
+def main():
+    parser = argparse.ArgumentParser(description='remove_blobs micro-benchmark.')
+    parser.add_argument('-i', '--input', help='Glob of grayscale crop images (synthetic crops are used when nothing matches).')
+    parser.add_argument('-n', '--count', type=int, default=20, help='Number of synthetic crops.')
+    parser.add_argument('--specks', type=int, nargs='+', default=[0, 100, 300, 1000], help='Specks added to each crop.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    crops = load_crops(args.input, args.count, rng)
+
+    print(f"{len(crops)} crops")
+    print(f"{'specks':>7} {'threshold':>9} {'loop ms':>8} {'vector ms':>9} {'speedup':>8}")
+    for specks in args.specks:
+        noisy = [add_specks(crop, specks, rng) for crop in crops]
+        for area_threshold in (40, 10):
+            loop_time, loop_outputs = measure(remove_blobs_loop, noisy, area_threshold, args.repeat)
+            vector_time, vector_outputs = measure(remove_blobs, noisy, area_threshold, args.repeat)
+            for expected, actual in zip(loop_outputs, vector_outputs):
+                assert np.array_equal(expected, actual), "outputs differ"
+            print(f"{specks:>7} {area_threshold:>9} {loop_time*1000:>8.2f} {vector_time*1000:>9.2f} {loop_time/vector_time:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from util.post_processing import sort_words, count_words_in_line
+from util.post_processing import WordLines
 import logging
 import re
 
@@ -35,8 +35,8 @@ def run(field):
     buffer = ''
 
     # get words
-    words = field['analysis']['words']
-    words = sort_words(words, line_threshold)
+    lines = WordLines(field['analysis']['words'], line_threshold)
+    words = lines.words
 
     for word in words:
         word_count += 1
@@ -62,7 +62,7 @@ def run(field):
 
         # handle cases where the separator reads as 1
         word_content = word['content']
-        words_in_line = count_words_in_line(words, line_number, line_threshold)
+        words_in_line = lines.count_words_in_line(line_number)
         # case 01: [99 1 00 => 99 00]
         if words_in_line == 3 and word_position_in_row == 2:
             if word_content.startswith('1'):
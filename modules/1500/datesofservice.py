@@ -1,4 +1,4 @@
-from util.post_processing import sort_words
+from util.post_processing import WordLines
 import logging
 
 def count_digits(string):
@@ -35,8 +35,7 @@ def run(field):
     skip_row = False
     
     # get words (digits only)
-    words = field['analysis']['words']
-    words = sort_words(words, line_threshold)
+    words = WordLines(field['analysis']['words'], line_threshold).words
     words =  [word for word in words if len([char for char in word['content'] if char.isdigit()]) >= 2]
 
     for word in words:
@@ -1,4 +1,4 @@
-from util.post_processing import sort_words, count_words_in_line
+from util.post_processing import WordLines
 import logging
 import re
 
@@ -28,8 +28,7 @@ def run(field):
     buffer = ''
 
     # get words
-    words = field['analysis']['words']
-    words = sort_words(words, line_threshold)
+    words = WordLines(field['analysis']['words'], line_threshold).words
 
     for word in words:
         word_count += 1
@@ -1,4 +1,4 @@
-from util.post_processing import sort_words, count_words_in_line
+from util.post_processing import WordLines
 import logging
 import re
 
@@ -30,8 +30,8 @@ def run(field):
     previous_top = 0
     
     # read words
-    words = field['analysis']['words']
-    words = sort_words(words, line_threshold)
+    lines = WordLines(field['analysis']['words'], line_threshold)
+    words = lines.words
     for word in words:
 
         word_content = word['content']
@@ -41,7 +41,7 @@ def run(field):
         distance_to_previous = abs(top - previous_top)
 
         # handle cases where the separator reads as 1
-        words_in_line = count_words_in_line(words, 1, line_threshold)
+        words_in_line = lines.count_words_in_line(1)
         # case 01: words = [$ 99 100 => $ 99 00]
         if words_in_line > 1 and word_position_in_row == words_in_line and len(word_content) == 3:
             if word_content.startswith('1'):
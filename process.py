@@ -1,43 +1,51 @@
 # Python Standard Library Imports
 import argparse
-import csv
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from glob import glob
-from io import BytesIO
 
 # Third Party Imports
 import cv2
-import importlib
-import imutils
-import numpy as np
 import yaml
 from dotenv import load_dotenv
-from pdf2image import convert_from_path
-from PIL import Image
 
 # Local Imports
-from util.computervision_api import object_detection_rest
+from util.concurrency import batched, ordered_map, run_stage
+from util import http_client
+from util.cache import DEFAULT_CACHE_DIR, configure_cache, get_cache
+from util.detection import TemplateDetector
 from util.formrec_api import analyze_document_rest
 from util.general import get_filename
-from util.pre_processing import crop, remove_blobs, remove_hlines
+from util.journal import DEFAULT_JOURNAL_FILE, JobJournal, STAGE_ANALYZED, STAGE_DETECTED, STAGE_POSTPROCESSED, STAGE_RASTERIZED
+from util.output import CsvSink, drop_failed, read_processed
+from util.layout import split_words
+from util.pipeline import Pipeline
+from util.retry import ServiceError
+from util.rate_limit import configure_rate_limits, get_throttling_stats
+from util.pre_processing import crop, crop_box, denoise, index_detections
+from util.rasterize import count_pages, render_page
+from util.telemetry import add_forms_in_flight, configure_metrics, configure_tracing, observe_form, shutdown_tracing, span, write_metrics
+from util.timing import add_durations, collect, get_timer, measure, start_timing, timed
 
 # Constants
 LOGGING_LEVEL = logging.INFO
-VISION_MODEL_ENV_VAR = "VISION_MODEL"
 DEBUG_MODE_ENV_VAR = "DEBUG_MODE"
 DEBUG_MODE_DEFAULT = 'false'
 PAGE_WIDTH = 1700
 PAGE_HEIGHT = 2256
 WORK_DIR = 'work'
 DEFAULT_INPUT = 'data/*.pdf'
+DEFAULT_WORKERS = 1
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_PAGES = '1'
+MAX_PAGES_PER_REQUEST = 2000
 
 # Configure Logging
 logging.basicConfig(level=LOGGING_LEVEL)
 load_dotenv()
 
-VISION_MODEL = os.environ.get(VISION_MODEL_ENV_VAR)
 DEBUG_MODE = os.environ.get(DEBUG_MODE_ENV_VAR) or DEBUG_MODE_DEFAULT
 debug_mode = True if DEBUG_MODE.lower() == 'true' else False
 
@@ -52,180 +60,505 @@ def get_files(files):
     else:
         return glob(f'{files}/*.pdf')
 
+def parse_pages(pages):
+    """
+    Parses a page selection: 'all', or comma separated page numbers and ranges such as '1', '2-5' or '1,3,7-'.
+
+    Returns:
+    ranges (list of tuple): (first, last) one-based inclusive page ranges, last is None for an open range.
+    """
+    if pages is None or pages.strip().lower() == 'all':
+        return [(1, None)]
+    ranges = []
+    for part in pages.split(','):
+        first, separator, last = part.strip().partition('-')
+        try:
+            first = int(first) if first else 1
+            last = (int(last) if last else None) if separator else first
+        except ValueError:
+            raise ValueError(f"Invalid page selection '{pages}', expected 'all' or page numbers and ranges such as 1,3-5")
+        if first < 1 or (last is not None and last < first):
+            raise ValueError(f"Invalid page range '{part.strip()}' in '{pages}'")
+        ranges.append((first, last))
+    return ranges
+
+def iter_pages(files, ranges, processed=()):
+    """
+    Yields the (file, page_index) pairs of the selected pages of each file, in order, skipping the (fileName, pageNumber)
+    pairs in processed. ranges is the page selection parsed by parse_pages. Page counts are read lazily, when the
+    iteration reaches each file.
+    """
+    for file in files:
+        # a single page selection does not need the page count
+        if ranges == [(1, 1)]:
+            page_count = 1
+        else:
+            page_count = count_pages(file)
+        selected = sorted({page for first, last in ranges for page in range(first, min(last or page_count, page_count)+1)})
+        for page_number in selected:
+            if (file.split('/')[-1], str(page_number)) not in processed:
+                yield file, page_number-1
+
 def load_config(config_file):
     with open(config_file, 'r') as f:
         return yaml.safe_load(f)
 
-def process_forms(files, config):
+def process_forms(files, config, workers=DEFAULT_WORKERS, batch_size=None, output_file=None, journal_file=None, pages=DEFAULT_PAGES, trace_file=None):
     """
     Processes a list of forms based on the provided configuration.
 
-    This function iterates over a list of form files, processes each form using the provided configuration, and writes the results to a CSV file. 
-    The CSV file is named with the current timestamp and stored in a predefined working directory.
+    This function iterates over the selected pages of a list of form files, processes each page as a separate form using the provided configuration,
+    and writes the results to a CSV file, one row per page. 
+    Pages whose service calls failed once their retries ran out get a row with the reason in the error column, and are retried when the run is resumed.
+    Unless an output file is given, the CSV file is named with the current timestamp and stored in a predefined working directory.
 
     Parameters:
     files (list of str): A list of file paths to the forms that need to be processed.
     config (dict): A dictionary containing configuration options for processing. 
                     The 'fields' key should contain a list of dictionaries, each representing a field to be processed in the form. 
                     Each field dictionary should have a 'name' key (the name of the field) and a 'cardinality' key (the number of times the field appears in the form).
+    workers (int): The number of forms processed concurrently. When greater than 1, the network-bound stages (object detection and document analysis)
+                    run in a thread pool of this size and the CPU-bound stages (rasterization, cropping and noise removal) run in a process pool.
+                    Rows are still written in the same order as the input pages.
+    batch_size (int): The number of forms whose field crops are sent in a single document analysis request.
+                    Defaults to document_analysis.batch_size in the config, or 1.
+    output_file (str): Optional path of the output CSV. If the file already exists the run resumes it: pages already present in it are
+                    skipped and the new rows are appended.
+    journal_file (str): Optional path of the job journal (SQLite). Each form's stage and intermediate results are recorded in it, and forms
+                    found in it continue from their last completed stage instead of being processed again.
+    pages (str): The pages of each file processed as forms: 'all', or page numbers and ranges such as '1,3-5' (see parse_pages).
+                    Defaults to the first page.
+    trace_file (str): Optional path of a JSONL file where the time each form spent in each stage is appended, one line per form.
 
     Returns:
-    None
+    summary (dict): The performance report of the run (see util.timing.StageTimer.summary), also written to the log.
 
     Raises:
     - FileNotFoundError: If any of the form files in the list do not exist.
     - KeyError: If the config dictionary does not contain the required keys.
+    - ValueError: If a post-processing module cannot be loaded, if the page selection is invalid, or if an existing output file does not have the columns of the config.
     """    
-    # create empty output file with header
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    output_file = os.path.join(WORK_DIR, f'{timestamp}.csv')
+    # resolve the detector, the post-processing modules and the page selection before any form is processed
+    pipeline = Pipeline(config)
+    ranges = parse_pages(pages)
+
+    if output_file is None:
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output_file = os.path.join(WORK_DIR, f'{timestamp}.csv')
     logging.info(f"### PROCESSING START ({output_file})")  
         
-    header = ['fileName']
-    for field in config['fields']:
-        for i in range(1, field['cardinality']+1):
-            field_name = f"{field['name']}_{i}"
-            header.append(field_name)
-
-    if not os.path.exists(WORK_DIR): os.makedirs(WORK_DIR)
-    with open(output_file, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=header)
-        writer.writeheader()
-  
+    # skip pages already written to the output file by a previous run, except the ones that failed
+    failed = drop_failed(output_file)
+    if failed > 0:
+        logging.info(f"Resuming {output_file}: retrying {failed} failed pages")
+    processed = read_processed(output_file)
+    if len(processed) > 0:
+        logging.info(f"Resuming {output_file}: {len(processed)} pages already processed")
+    form_pages = iter_pages(files, ranges, processed)
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir): os.makedirs(output_dir)
+
     # Process each file
-    for idx, image_file in enumerate(files):
-        record = process_form(image_file, config)
-        with open(output_file, "a", newline="") as f:
-                writer = csv.DictWriter(f, fieldnames=header)
-                writer.writerow(record)
+    batch_size = get_batch_size(config, batch_size)
+    journal = JobJournal(journal_file, config) if journal_file else None
+    timer = start_timing(trace_file)
+    requests = {endpoint: stats['requests'] for endpoint, stats in get_throttling_stats().items()}
+    failed = 0
+    try:
+        with CsvSink(output_file, pipeline.header) as sink:
+            for record in process_records(form_pages, pipeline, workers, batch_size, journal):
+                failed += 1 if record.get('error') else 0
+                sink.write(record)
+    finally:
+        timer.close()
+        if journal is not None:
+            journal.close()
+
+    detector = pipeline.detector
+    if isinstance(detector, TemplateDetector):
+        logging.info(f"Template alignment: {detector.aligned} pages aligned, {detector.fallbacks} sent to the detector")
+
+    if failed > 0:
+        logging.warning(f"{failed} pages failed, run again with the same output file to retry them")
+
+    api_calls = {endpoint: stats['requests'] - requests.get(endpoint, 0) for endpoint, stats in get_throttling_stats().items()}
+    summary = timer.summary(api_calls)
+    log_summary(summary)
 
     logging.info(f"### PROCESSING DONE ({output_file})")  
+    return summary
 
-def initialize_record(config, image_file):
-    record = {'fileName': image_file.split('/')[-1]}
-    for field in config['fields']:
-        for i in range(1, field['cardinality']+1):
-            field_name = f"{field['name']}_{i}"
-            record[field_name] = ''
-    return record
+def log_summary(summary):
+    """
+    Writes the performance report of a run to the log: throughput, API calls per form, p50/p95/p99 of each stage (milliseconds)
+    and its CPU time.
+    """
+    logging.info(f"Processed {summary['forms']} forms in {summary['elapsed']:.1f}s ({summary['forms_per_minute']:.1f} forms per minute)")
+    if summary['api_calls_per_form']:
+        logging.info("API calls per form: " + ", ".join(f"{endpoint} {calls:.2f}" for endpoint, calls in summary['api_calls_per_form'].items()))
+    for stage, stats in summary['stages'].items():
+        logging.info(f"Stage {stage:<13} {stats['count']:>6} forms  p50 {stats['p50']*1000:9.1f}ms  p95 {stats['p95']*1000:9.1f}ms  "
+                     f"p99 {stats['p99']*1000:9.1f}ms  total {stats['total']:.1f}s  cpu {stats['cpu']:.1f}s")
+
+def process_records(form_pages, pipeline, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE, journal=None):
+    """
+    Yields the record of each form, in input order.
 
-def process_form(form_file, config):
+    Forms are (file, page_index) pairs, consumed lazily so pages are only counted and rendered as the batches get to them.
+    They are grouped in batches of batch_size forms whose field crops are analyzed with a single document analysis
+    request. With a single worker the batches are processed one after the other. Otherwise at most `workers` batches
+    wait on remote calls at the same time and the CPU-bound stages are sent to a process pool, so the pages of a
+    multi-page file are processed in parallel.
     """
-    Processes a single form based on the provided configuration.
+    batches = batched(form_pages, batch_size)
+
+    if workers <= 1:
+        for batch in batches:
+            yield from process_batch(batch, pipeline, journal=journal)
+        return
+
+    cpu_workers = min(workers, os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=cpu_workers) as cpu_pool, ThreadPoolExecutor(max_workers=workers) as io_pool:
+        def process(batch):
+            return process_batch(batch, pipeline, cpu_pool, journal)
+        for records in ordered_map(io_pool, process, batches, max_pending=2*workers):
+            yield from records
 
-    This function reads a form file, applies object detection to identify fields, crops the fields, removes noise, applies document analysis, and finally post-processes the results.
+def get_batch_size(config, batch_size=None):
+    """
+    Returns the number of forms per document analysis request: the given value, or document_analysis.batch_size
+    from the config, limited so a request stays under MAX_PAGES_PER_REQUEST pages (one page per field).
+    """
+    if batch_size is None:
+        batch_size = config['document_analysis'].get('batch_size', DEFAULT_BATCH_SIZE)
+    max_batch_size = max(MAX_PAGES_PER_REQUEST // len(config['fields']), 1)
+    if batch_size > max_batch_size:
+        logging.warning(f"Batch size {batch_size} exceeds {MAX_PAGES_PER_REQUEST} pages per request, using {max_batch_size}")
+    return max(min(batch_size, max_batch_size), 1)
+
+def rasterize_form(form_file, page_index=0, grayscale=False, encode=True):
+    """
+    Renders a page of a form file at PAGE_WIDTH and encodes it as JPEG for object detection.
 
     Parameters:
-    form_file (str): The path to the form file that needs to be processed.
-    config (dict): A dictionary containing configuration options for processing. The 'fields' key should contain a list of dictionaries, each representing a field to be processed in the form. Each field dictionary should have a 'name' key (the name of the field), a 'cropping' key (parameters for cropping the field), a 'remove_noise' key (a boolean indicating whether noise should be removed from the field), and a 'postprocessing' key (parameters for post-processing the field).
+    form_file (str): The path to the form file.
+    page_index (int): The zero-based index of the page.
+    grayscale (bool): Render a single channel image (rasterization.grayscale in the config).
+    encode (bool): Encode the page as JPEG (only needed by detectors that upload the page).
 
     Returns:
-    record (dict): A dictionary containing the extracted field values.
-
-    The function works as follows:
-    - It first initializes a record for the form.
-    - It then reads the form file and resizes the image.
-    - It applies object detection to the image.
-    - It iterates over each field in the config:
-        - It crops the field from the image.
-        - If the 'remove_noise' key is true, it removes noise from the field.
-        - It adds a white border to the cropped field.
-    - It saves the cropped fields to a combined PDF.
-    - It applies document analysis to the PDF.
-    - It post-processes the results of the document analysis.
-    - Finally, it returns the record with the extracted field values.
+    input_image (numpy.ndarray): The page image.
+    input_bytes (bytes): The JPEG encoded page image, or None when encode is false.
     """
+    with timed('rasterize'):
+        input_image = render_page(form_file, PAGE_WIDTH, page_index, grayscale)
+    if not encode:
+        return input_image, None
+    with timed('encode'):
+        success, encoded_image = cv2.imencode('.jpg', input_image)
+    return input_image, encoded_image.tobytes()
+
+def preprocess_fields(input_image, object_detection_result, fields):
+    """
+    Crops every configured field from the page image, removes noise where configured and adds a white border.
 
-    logging.info(f"### PROCESSING FILE: {form_file}")
-
-    record = initialize_record(config, form_file)
+    The detection result is indexed by label once per page. Denoised fields with the same crop box (the same label and cropping
+    settings) share one denoised crop. Fields with different boxes are denoised on their own, as the blob and line removal of a
+    region depends on all of its pixels.
 
-    # read input file
-    pages = convert_from_path(form_file, dpi=200, first_page=0, last_page=1)
-    image = np.array(pages[0])
-    input_image = imutils.resize(image, width=PAGE_WIDTH)
+    Parameters:
+    input_image (numpy.ndarray): The page image the detection was run on.
+    object_detection_result (dict): The result of the object detection for the page.
+    fields (tuple of util.pipeline.FieldSpec): The configured fields.
 
-    if debug_mode:
-        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-        input_filename = get_filename(timestamp+'_'+form_file.split('/')[-1].split('.')[0], "input")
-        cv2.imwrite(input_filename, input_image) 
-    
-    success, encoded_image = cv2.imencode('.jpg', input_image)
-    input_bytes = encoded_image.tobytes()
-
-    ##########################
-    # Preprocessing
-    ##########################
-
-    # Detection
-    object_detection_result = object_detection_rest(input_bytes, VISION_MODEL)
-
-    fields = config['fields']
-
-    for field in fields:
-
-        # Cropping
-        cropped, confidence, found = crop(input_image, object_detection_result, field['cropping'])
-        field['cropping']['confidence'] = confidence
-        field['cropping']['found'] = found
-        if not found:
-            logging.info(f"Could not detect {field['name']}. Confidence: {confidence}")
-        cropped = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
-
-        # Remove noise
-        if field['remove_noise']:
-            cropped = remove_blobs(cropped, 40)
-            cropped = remove_hlines(cropped)
-            cropped = remove_blobs(cropped, 10)
-            cropped = remove_hlines(cropped)
+    Returns:
+    list of tuple: One (cropped, confidence, found) tuple per field, in the same order as the fields.
+    """
+    with timed('crop'):
+        detections = index_detections(object_detection_result)
+        boxes = [crop_box(detections, field.cropping, input_image.shape) for field in fields]
+
+    denoised_crops = {}
+    crops = []
+    for field, (box, confidence, found) in zip(fields, boxes):
+
+        if found and field.remove_noise:
+            # Cropping and removing noise, once per box
+            if box not in denoised_crops:
+                top, bottom, left, right = box
+                cropped = input_image[top:bottom, left:right]
+                if cropped.ndim == 3:
+                    cropped = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
+                with timed('denoise'):
+                    denoised_crops[box] = denoise(cropped, 40, 10)
+            cropped = denoised_crops[box]
+        else:
+            # Cropping
+            with timed('crop'):
+                cropped, confidence, found = crop(input_image, object_detection_result, field.cropping, detections)
+            if cropped.ndim == 3:
+                cropped = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
+
+            # Remove noise
+            if field.remove_noise:
+                with timed('denoise'):
+                    cropped = denoise(cropped, 40, 10)
             
         # Add white border to cropped image
         border_size = 10
         cropped = cv2.copyMakeBorder(cropped, border_size, border_size, border_size, border_size, cv2.BORDER_CONSTANT, value=[255, 255, 255])
-        field['cropping']['roi'] = cropped
-
-        if debug_mode:
-            timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-            cropped_filename = get_filename(timestamp, f"cropped_{field['name']}")
-            cv2.imwrite(cropped_filename, cropped)
-            field['cropping']['filename'] = cropped_filename
-
-    # Save cropped images to combined pdf
-    images = []
-    page_number = 1
-
-    for field in fields:
-        images.append(Image.fromarray(field['cropping']['roi']))
-        field['cropping']['page_number'] = page_number
-        page_number += 1
-    
-    buffer = BytesIO()
-    images[0].save(buffer, "PDF", save_all=True, append_images=images[1:], resolution=200, optimize=True, quality=100)
-    buffer.seek(0)
-    pdf_data = buffer.read()
+        crops.append((cropped, confidence, found))
+    return crops
 
-    #####################
-    # Document Analysis
-    #####################
-    
-    fr_result = analyze_document_rest(pdf_data, config['document_analysis']['model'], config['document_analysis']['api_version'], []) # , ['ocr.highResolution']
+def restore_form(form_page, pipeline, journal=None):
+    """
+    Creates the state of a form (a page of a file) and, when a journal is given, restores the last stage completed by a previous run.
+
+    Returns:
+    form (util.pipeline.FormContext): The form state. For post-processed forms the record is the final one, analyzed forms get the
+    cropping results and words of their fields and other journaled forms get their detection result.
+    """
+    form_file, page_index = form_page
+    form = pipeline.new_form(form_file, page_index)
+
+    entry = journal.get(form_file, page_index) if journal is not None else None
+    if entry is None:
+        return form
+    if entry['stage'] == STAGE_POSTPROCESSED:
+        logging.info(f"### SKIPPING FILE (already processed): {form_file}, page {page_index+1}")
+        form.stage = STAGE_POSTPROCESSED
+        form.record = entry['record']
+    elif entry['stage'] == STAGE_ANALYZED:
+        logging.info(f"### RESUMING FILE (already analyzed): {form_file}, page {page_index+1}")
+        for state, analysis in zip(form.fields, entry['analysis']):
+            state.confidence = analysis['confidence']
+            state.found = analysis['found']
+            state.words = analysis['words']
+        form.stage = STAGE_ANALYZED
+    else:
+        form.detection = entry['detection']
+    return form
+
+def prepare_forms(form_pages, pipeline, cpu_pool=None, journal=None):
+    """
+    Runs the preprocessing of a batch of forms: rasterization, object detection, cropping and noise removal.
+
+    Forms are rasterized and detected in groups of the detector batch size, so a local detector runs batched inference
+    across pages. When a journal is given, each form continues from the last stage completed by a previous run:
+    post-processed forms are returned as they are, analyzed forms skip the preprocessing and detected forms reuse
+    the detection result.
+
+    Parameters:
+    form_pages (list of tuple): The (file, page_index) pairs of the forms that need to be processed.
+    pipeline (util.pipeline.Pipeline): The compiled processing configuration (see process_batch).
+    cpu_pool (concurrent.futures.ProcessPoolExecutor): Optional process pool used to run rasterization, cropping and noise removal.
+    journal (util.journal.JobJournal): Optional journal recording the stage reached by each form.
+
+    Returns:
+    forms (list of util.pipeline.FormContext): The state of each form (see restore_form), with the cropping confidence, found flag
+    and cropped image of each field for the forms that went through the preprocessing. Forms whose object detection failed
+    have their error set and stay at the rasterized stage.
+    """
+    forms = [restore_form(form_page, pipeline, journal) for form_page in form_pages]
+    pending = [form for form in forms if form.stage is None]
+
+    detector = pipeline.detector
+    grayscale = pipeline.config.get('rasterization', {}).get('grayscale', False)
+
+    for start in range(0, len(pending), detector.batch_size):
+        group = pending[start:start+detector.batch_size]
+
+        # read input files
+        images = []
+        encoded_images = []
+        for form in group:
+            logging.info(f"### PROCESSING FILE: {form.file}, page {form.page+1}")
+            (input_image, input_bytes), durations = run_stage(cpu_pool, measure, rasterize_form, form.file, form.page, grayscale, detector.needs_encoded_image)
+            add_durations(form.timings, durations)
+            images.append(input_image)
+            encoded_images.append(input_bytes)
+            form.stage = STAGE_RASTERIZED
+            if journal is not None and form.detection is None:
+                journal.update(form.file, form.page, STAGE_RASTERIZED)
+
+            if debug_mode:
+                timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+                input_filename = get_filename(timestamp+'_'+form.file.split('/')[-1].split('.')[0]+f"_p{form.page+1}", "input")
+                cv2.imwrite(input_filename, input_image) 
+
+        ##########################
+        # Preprocessing
+        ##########################
+
+        # Detection
+        undetected = [i for i, form in enumerate(group) if form.detection is None]
+        if len(undetected) > 0:
+            try:
+                with collect() as durations, timed('detection'):
+                    results = detector.detect([images[i] for i in undetected], [encoded_images[i] for i in undetected])
+            except ServiceError as e:
+                logging.error(f"Object detection failed: {e}")
+                for i in undetected:
+                    group[i].error = f"detection: {e}"
+                results = []
+            for i in undetected:
+                add_durations(group[i].timings, durations, 1 / len(undetected))
+            for i, object_detection_result in zip(undetected, results):
+                group[i].detection = object_detection_result
+                if journal is not None:
+                    journal.update(group[i].file, group[i].page, STAGE_DETECTED, detection=object_detection_result)
+
+        for form, input_image in zip(group, images):
+            if form.error is not None:
+                continue
+            form.stage = STAGE_DETECTED
+
+            # Cropping and noise removal
+            crops, durations = run_stage(cpu_pool, measure, preprocess_fields, input_image, form.detection, pipeline.fields)
+            add_durations(form.timings, durations)
+
+            for field, state, (cropped, confidence, found) in zip(pipeline.fields, form.fields, crops):
+                state.confidence = confidence
+                state.found = found
+                if not found:
+                    logging.info(f"Could not detect {field.name}. Confidence: {confidence}")
+                state.roi = cropped
+
+                if debug_mode:
+                    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+                    cropped_filename = get_filename(timestamp, f"cropped_{field.name}")
+                    cv2.imwrite(cropped_filename, cropped)
+                    state.filename = cropped_filename
+
+    return forms
+
+def process_batch(form_pages, pipeline, cpu_pool=None, journal=None):
+    """
+    Processes a batch of forms based on the provided configuration.
+
+    This function reads each form file, applies object detection to identify fields, crops the fields and removes noise. The crops of all the
+    forms of the batch are then sent in a single document analysis request, and finally the results are post-processed for each form.
+
+    Parameters:
+    form_pages (list of tuple): The (file, page_index) pairs of the forms that need to be processed, each page being a separate form.
+    pipeline (util.pipeline.Pipeline): The compiled config. Its fields are read-only specs with the name of the field, its cropping parameters, whether noise should be removed from it and its post-processing module; the state of each form is kept apart, in a FormContext.
+    cpu_pool (concurrent.futures.ProcessPoolExecutor): Optional process pool used to run rasterization, cropping and noise removal.
+    journal (util.journal.JobJournal): Optional journal where the stage reached by each form and the intermediate results are recorded.
+                    Forms found in it continue from their last completed stage.
+
+    Returns:
+    records (list of dict): One dictionary per form, in the same order as form_pages, containing the extracted field values.
+                    When a service call failed once its retries ran out (see util.retry), the records of the forms it was made for
+                    only have their error column set and the other forms of the batch are still processed.
+
+    The function works as follows:
+    - For each form:
+        - It initializes a record for the form.
+        - It renders the form page at PAGE_WIDTH.
+        - It applies object detection to the image.
+        - It iterates over each field in the config:
+            - It crops the field from the image.
+            - If the 'remove_noise' key is true, it removes noise from the field.
+            - It adds a white border to the cropped field.
+    - It saves the cropped fields of all forms to a combined document (PDF or TIFF, see util.payload), one page per (form, field)
+      or packed on shared pages (see util.layout).
+    - It applies document analysis to the PDF.
+    - It maps the words of the result back to their form and field and post-processes them.
+    - Finally, it returns the records with the extracted field values.
+    """
+    add_forms_in_flight(len(form_pages))
+    try:
+        with span("process_batch", forms=len(form_pages)):
+            return run_batch(form_pages, pipeline, cpu_pool, journal)
+    finally:
+        add_forms_in_flight(-len(form_pages))
+
+def run_batch(form_pages, pipeline, cpu_pool=None, journal=None):
+    # the stages of process_batch, run in its span
+    forms = prepare_forms(form_pages, pipeline, cpu_pool, journal)
+    pending = [form for form in forms if form.stage == STAGE_DETECTED and form.error is None]
+
+    if len(pending) > 0:
+
+        # Save cropped images to a combined document (document_analysis.layout and payload_format)
+        with collect() as durations, timed('payload'):
+            states = [state for form in pending for state in form.fields]
+            pages, slots = pipeline.place_crops([state.roi for state in states])
+            for state, slot in zip(states, slots):
+                # the crop is not needed once it is in the document
+                state.roi = None
+                state.page_number = slot.page_number
+
+            payload = pipeline.encode_payload(pages)
+        for form in pending:
+            add_durations(form.timings, durations, 1 / len(pending))
+        logging.info(f"Analysis payload ({pipeline.layout}, {pipeline.payload_format}): {len(slots)} crops on {len(pages)} pages, {len(payload)} bytes for {len(pending)} forms, {len(payload) // len(pending)} bytes per form")
+        # release the page images while the request is in flight
+        del pages
+
+        #####################
+        # Document Analysis
+        #####################
+        
+        document_analysis = pipeline.config['document_analysis']
+        try:
+            with collect() as durations:
+                fr_result = analyze_document_rest(payload, document_analysis['model'], document_analysis['api_version'], []) # , ['ocr.highResolution']
+        except ServiceError as e:
+            logging.error(f"Document analysis of {len(pending)} forms failed: {e}")
+            for form in pending:
+                form.error = f"analysis: {e}"
+            fr_result = None
+        for form in pending:
+            add_durations(form.timings, durations, 1 / len(pending))
+        if fr_result is None:
+            pending = []
+        else:
+            for state, words in zip(states, split_words(fr_result, slots)):
+                state.words = words
+
+        for form in pending:
+            form.stage = STAGE_ANALYZED
+            if journal is not None:
+                analysis = [{'confidence': state.confidence, 'found': state.found, 'words': state.words} for state in form.fields]
+                journal.update(form.file, form.page, STAGE_ANALYZED, analysis=analysis)
 
     #####################
     # Postprocessing 
     #####################
 
-    for field in fields:
-        for page in fr_result['pages']:
-            if page['pageNumber'] == field['cropping']['page_number']:
-                field['analysis'] = {'words': page['words']} 
-                module = importlib.import_module("modules." + field['postprocessing']['module'])
-                post_process_result = module.run(field)
-                record = {**record, **post_process_result}
-                break
+    timer = get_timer()
+    records = []
+    for form in forms:
+        record = form.record
+        if form.error is not None:
+            # not journaled, the form continues from its last completed stage when the run is resumed
+            record = {**record, 'error': form.error}
+        elif form.stage == STAGE_ANALYZED:
+            with collect() as durations, timed('postprocess'):
+                record = pipeline.postprocess(record, form.fields)
+            add_durations(form.timings, durations)
+            if journal is not None:
+                journal.update(form.file, form.page, STAGE_POSTPROCESSED, record=record)
+        records.append(record)
+        if len(form.timings) > 0:
+            observe_form(form.timings, form.error)
+            if timer is not None:
+                timer.record(form.file, form.page, form.timings, form.error)
+
+    return records
+
+def process_form(form_file, pipeline, cpu_pool=None, journal=None, page_index=0):
+    """
+    Processes a single form based on the provided configuration (a batch of one form, see process_batch).
 
-    return record
+    Returns:
+    record (dict): A dictionary containing the extracted field values.
+    """
+    return process_batch([(form_file, page_index)], pipeline, cpu_pool, journal)[0]
         
-def main(config_file, files=None):
+def main(config_file, files=None, workers=DEFAULT_WORKERS, batch_size=None, output_file=None, journal_file=None, pages=DEFAULT_PAGES, trace_file=None):
     files = get_files(files)
     config = load_config(config_file)
 
@@ -233,17 +566,50 @@ def main(config_file, files=None):
         logging.info(f"No files to process")
         exit(0)
 
-    process_forms(files, config)
+    process_forms(files, config, workers, batch_size, output_file, journal_file, pages, trace_file)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Extract form fields.')
     parser.add_argument('-i', '--input', help='Folder where the pdfs are or a single pdf file.')
     parser.add_argument('-c', '--config', help='Document intelligence config file.')    
+    parser.add_argument('-o', '--output', help='Output CSV file. If it already exists, pages already in it are skipped and new rows are appended.')
+    parser.add_argument('-p', '--pages', default=DEFAULT_PAGES, help="Pages of each pdf processed as separate forms: 'all', or page numbers and ranges such as 1,3-5 (default 1).")
+    parser.add_argument('-j', '--journal', nargs='?', const=DEFAULT_JOURNAL_FILE, help=f"Record each file's stage in a job journal (default {DEFAULT_JOURNAL_FILE}) so a restarted run continues where it stopped.")
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS, help='Number of forms processed concurrently.')
+    parser.add_argument('-b', '--batch-size', type=int, help='Number of forms per document analysis request (defaults to document_analysis.batch_size in the config).')
+    parser.add_argument('--pool-size', type=int, help='HTTP connection pool size (defaults to HTTP_POOL_SIZE).')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Folder of the object detection and document analysis result cache.')
+    parser.add_argument('--no-cache', action='store_true', help='Always call the services, without reading or writing the result cache.')
+    parser.add_argument('--trace', help='Append the time each form spent in each stage to this JSONL file.')
+    parser.add_argument('--spans-file', help='Export tracing spans as JSON lines to this file (requires opentelemetry-sdk).')
+    parser.add_argument('--otlp-endpoint', help='Export tracing spans to an OpenTelemetry collector, e.g. http://localhost:4318/v1/traces (requires opentelemetry-exporter-otlp).')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics at http://127.0.0.1:PORT/metrics while the run lasts (requires prometheus_client).')
+    parser.add_argument('--metrics-file', help='Write the Prometheus metrics to this file at the end of the run (requires prometheus_client).')
     args = parser.parse_args()
 
-    if args.input:
-        main(args.config, args.input)
-    else:
-        main(args.config)
+    http_client.configure(pool_size=args.pool_size)
+    configure_rate_limits(max_concurrency=http_client.HTTP_POOL_SIZE)
+    if not args.no_cache:
+        configure_cache(args.cache_dir)
+    if args.spans_file or args.otlp_endpoint:
+        configure_tracing(args.spans_file, args.otlp_endpoint)
+    if args.metrics_port is not None or args.metrics_file:
+        configure_metrics(args.metrics_port)
+
+    try:
+        main(args.config, args.input, args.workers, args.batch_size, args.output, args.journal, args.pages, args.trace)
+    finally:
+        shutdown_tracing()
+        if args.metrics_file:
+            write_metrics(args.metrics_file)
+
+    cache = get_cache()
+    if cache is not None:
+        logging.info(f"Cache hits: {cache.hits}, misses: {cache.misses} ({cache.cache_dir})")
+
+    for endpoint, stats in get_throttling_stats().items():
+        if stats['requests'] > 0:
+            logging.info(f"Rate limiter {endpoint}: {stats['requests']} requests, {stats['throttled']} throttled (429), "
+                         f"{stats['throttle_wait']:.1f}s lost to throttling, {stats['queue_wait']:.1f}s queued, concurrency {stats['concurrency']}")
 
     logging.info(f"Done")
\ No newline at end of file
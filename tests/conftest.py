@@ -0,0 +1,24 @@
+import os
+import sys
+
+# the service modules read their endpoints at import, tests only talk to local mock services
+os.environ.setdefault("VISION_ENDPOINT", "http://localhost/")
+os.environ.setdefault("VISION_KEY", "")
+os.environ.setdefault("VISION_MODEL", "test")
+os.environ.setdefault("FORM_RECOGNIZER_ENDPOINT", "http://localhost/")
+os.environ.setdefault("FORM_RECOGNIZER_KEY", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from util.cache import disable_cache
+from util.rate_limit import configure_rate_limits
+
+@pytest.fixture(autouse=True)
+def fresh_clients():
+    # results cached or limits learned by a test must not leak into the next one
+    disable_cache()
+    configure_rate_limits()
+    yield
+    disable_cache()
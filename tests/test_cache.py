@@ -0,0 +1,49 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+import process
+from benchmarks.end_to_end import synthetic_forms
+from benchmarks.mock_service import Fixtures, MockService, label_boxes
+from util import computervision_api
+from util.cache import configure_cache
+from util.payload import PAYLOAD_ENCODERS, encode_pdf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def config(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    return process.load_config('1500.config.yaml')
+
+@pytest.fixture
+def service(config, monkeypatch):
+    service = MockService(Fixtures(None, label_boxes(config)), latency=0.0, analyze_latency=0.1).start()
+    monkeypatch.setenv("FORM_RECOGNIZER_ENDPOINT", service.url)
+    monkeypatch.setattr(computervision_api, "VISION_ENDPOINT", service.url)
+    yield service
+    service.stop()
+
+def test_encode_pdf_is_deterministic():
+    crops = [np.random.default_rng(page).integers(0, 256, (40, 120), dtype=np.uint8) for page in range(3)]
+    first = encode_pdf(crops)
+    # PIL writes the current time in PDFs unless told otherwise
+    time.sleep(1.1)
+    assert encode_pdf(crops) == first
+
+@pytest.mark.parametrize('payload_format', [name for name in PAYLOAD_ENCODERS if name != 'pdf-g4'])
+def test_second_run_is_served_from_cache(config, service, payload_format, tmp_path):
+    config['document_analysis']['payload_format'] = payload_format
+    configure_cache(str(tmp_path / 'cache'))
+    files = synthetic_forms(config, 2, str(tmp_path))
+
+    process.process_forms(files, config, 1, None, str(tmp_path / 'first.csv'))
+    requests = {endpoint: stats['requests'] for endpoint, stats in service.stats.items()}
+    assert requests['vision'] > 0 and requests['formrec'] > 0
+    process.process_forms(files, config, 1, None, str(tmp_path / 'second.csv'))
+
+    # the same forms with the same config: every detection and analysis comes from the cache
+    assert {endpoint: stats['requests'] for endpoint, stats in service.stats.items()} == requests
+    assert (tmp_path / 'first.csv').read_text() == (tmp_path / 'second.csv').read_text()
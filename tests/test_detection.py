@@ -0,0 +1,159 @@
+import copy
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import process
+from util.detection import OnnxDetector, TemplateDetector, get_detector
+from util.pipeline import Pipeline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def config(monkeypatch, tmp_path):
+    monkeypatch.chdir(ROOT)
+    config = copy.deepcopy(process.load_config('1500.config.yaml'))
+    template = str(tmp_path / 'template.png')
+    cv2.imwrite(template, np.random.default_rng(0).integers(0, 256, (400, 300), dtype=np.uint8))
+    config['detection']['template'].update({'enabled': True, 'image': template})
+    return config
+
+def test_template_boxes_must_cover_every_label(config):
+    config['detection']['template']['boxes'] = {'charges': [58, 1600, 1580, 330], 'total_charges': [1080, 1955, 230, 60]}
+    with pytest.raises(ValueError, match="no box for the labels birthdate, datesofservice, qty, totacharges .*unknown labels: total_charges"):
+        Pipeline(config)
+
+def test_template_without_boxes(config):
+    with pytest.raises(ValueError, match="no box for the labels"):
+        get_detector(config)
+
+def test_template_with_every_label(config):
+    labels = {field['cropping']['label'] for field in config['fields']}
+    config['detection']['template']['boxes'] = {label: [10, 10 + 50*i, 100, 40] for i, label in enumerate(sorted(labels))}
+    assert isinstance(get_detector(config), TemplateDetector)
+
+class RecordingDetector:
+    needs_encoded_image = True
+    batch_size = 1
+
+    def __init__(self):
+        self.pages = []
+
+    def detect(self, images, encoded_images):
+        assert len(encoded_images) == len(images)
+        self.pages.extend(images)
+        return [{'fallback': True} for _ in images]
+
+def template_page():
+    rng = np.random.default_rng(13)
+    page = np.full((2256, 1700), 255, np.uint8)
+    for i in range(300):
+        cv2.putText(page, f"ABC{i}", (int(rng.integers(0, 1600)), int(rng.integers(0, 2200))), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2)
+    for y in range(100, 2200, 120):
+        cv2.line(page, (50, y), (1650, y), 0, 2)
+    return page
+
+def test_template_maps_boxes_on_a_shifted_page(tmp_path):
+    template = template_page()
+    cv2.imwrite(str(tmp_path / 'template.png'), template)
+    boxes = {'birthdate': [700, 330, 330, 60], 'charges': [58, 1600, 1580, 330], 'totacharges': [1080, 1955, 230, 60]}
+    fallback = RecordingDetector()
+    detector = TemplateDetector({'image': str(tmp_path / 'template.png'), 'boxes': boxes}, fallback)
+
+    dx, dy = 23, -17
+    shifted = cv2.warpAffine(template, np.float32([[1, 0, dx], [0, 1, dy]]), (1700, 2256), borderValue=255)
+    blank = np.full((2256, 1700, 3), 255, np.uint8)
+    results = detector.detect([cv2.cvtColor(shifted, cv2.COLOR_GRAY2RGB), blank])
+
+    values = {value['tags'][0]['name']: value['boundingBox'] for value in results[0]['customModelResult']['objectsResult']['values']}
+    assert set(values) == set(boxes)
+    for label, (x, y, w, h) in boxes.items():
+        box = values[label]
+        assert abs(box['x'] - (x + dx)) <= 2 and abs(box['y'] - (y + dy)) <= 2, label
+        assert abs(box['w'] - w) <= 2 and abs(box['h'] - h) <= 2, label
+    # the blank page does not align and goes to the fallback detector
+    assert results[1] == {'fallback': True}
+    assert len(fallback.pages) == 1 and fallback.pages[0] is blank
+    assert (detector.aligned, detector.fallbacks) == (1, 1)
+
+def onnx_detector(tmp_path, shape, **config):
+    """
+    An OnnxDetector on a generated model with the custom Vision outputs: two boxes per image, the first scored with
+    the mean of the blue channel / 255 and the second with 0.05.
+    """
+    onnx = pytest.importorskip('onnx')
+    from onnx import TensorProto, helper, numpy_helper
+
+    constants = {
+        'boxes': np.array([[[0.1, 0.2, 0.3, 0.25], [0.5, 0.5, 0.7, 0.55]]], np.float32),
+        'low_score': np.array([[0.05]], np.float32),
+        'classes': np.array([[1, 0]], np.int64),
+        'scale': np.array(255, np.float32),
+        'zero': np.array([0], np.int64),
+        'one': np.array([1], np.int64),
+        'ones': np.array([1, 1], np.int64),
+    }
+    nodes = [
+        helper.make_node('Shape', ['image_tensor'], ['shape']),
+        helper.make_node('Slice', ['shape', 'zero', 'one'], ['batch']),
+        helper.make_node('Concat', ['batch', 'ones'], ['repeat_boxes'], axis=0),
+        helper.make_node('Concat', ['batch', 'one'], ['repeat'], axis=0),
+        helper.make_node('ReduceMean', ['image_tensor'], ['means'], axes=[2, 3], keepdims=0),
+        helper.make_node('Slice', ['means', 'zero', 'one', 'one'], ['blue_mean']),
+        helper.make_node('Div', ['blue_mean', 'scale'], ['blue_score']),
+        helper.make_node('Tile', ['low_score', 'repeat'], ['low_scores']),
+        helper.make_node('Concat', ['blue_score', 'low_scores'], ['detected_scores'], axis=1),
+        helper.make_node('Tile', ['boxes', 'repeat_boxes'], ['detected_boxes']),
+        helper.make_node('Tile', ['classes', 'repeat'], ['detected_classes']),
+    ]
+    graph = helper.make_graph(
+        nodes, 'detector', [helper.make_tensor_value_info('image_tensor', TensorProto.FLOAT, shape)],
+        [helper.make_tensor_value_info(name, element_type, None) for name, element_type in
+         [('detected_boxes', TensorProto.FLOAT), ('detected_scores', TensorProto.FLOAT), ('detected_classes', TensorProto.INT64)]],
+        [numpy_helper.from_array(value, name) for name, value in constants.items()])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.save(model, str(tmp_path / 'model.onnx'))
+    (tmp_path / 'labels.txt').write_text('charges\nqty\n')
+    return OnnxDetector({'model_path': str(tmp_path / 'model.onnx'), 'labels_path': str(tmp_path / 'labels.txt'), **config})
+
+def page(blue, height=200, width=400):
+    image = np.zeros((height, width, 3), np.uint8)
+    image[:, :, 2] = blue
+    return image
+
+def test_onnx_detector_batches_pages(tmp_path):
+    pytest.importorskip('onnxruntime')
+    detector = onnx_detector(tmp_path, ['N', 3, 32, 48], batch_size=2)
+    assert (detector.batch_size, detector.input_height, detector.input_width) == (2, 32, 48)
+    runs = []
+    run = detector.session.run
+    detector.session.run = lambda names, feed: runs.append(feed[detector.input_name].shape) or run(names, feed)
+
+    blues = [51, 102, 0, 204, 255]
+    results = detector.detect([page(blue) for blue in blues])
+    assert runs == [(2, 3, 32, 48), (2, 3, 32, 48), (1, 3, 32, 48)]
+    # results in page order, the boxes scaled to the page and those under the score threshold dropped
+    for blue, result in zip(blues, results):
+        values = result['customModelResult']['objectsResult']['values']
+        if blue == 0:
+            assert values == []
+            continue
+        assert [value['boundingBox'] for value in values] == [{'x': 40, 'y': 40, 'w': 80, 'h': 10}]
+        assert values[0]['tags'][0]['name'] == 'qty'
+        assert values[0]['tags'][0]['confidence'] == pytest.approx(blue / 255)
+
+def test_onnx_detector_with_a_fixed_batch(tmp_path):
+    pytest.importorskip('onnxruntime')
+    detector = onnx_detector(tmp_path, [1, 3, 32, 48], batch_size=8)
+    assert detector.batch_size == 1
+    results = detector.detect([page(102, 100, 100), page(204, 300, 500)])
+    assert [result['customModelResult']['objectsResult']['values'][0]['boundingBox'] for result in results] == \
+        [{'x': 10, 'y': 20, 'w': 20, 'h': 5}, {'x': 50, 'y': 60, 'w': 100, 'h': 15}]
+
+def test_onnx_detector_needs_a_fixed_image_size(tmp_path):
+    pytest.importorskip('onnxruntime')
+    with pytest.raises(ValueError, match="fixed image size"):
+        onnx_detector(tmp_path, ['N', 3, 'height', 'width'])
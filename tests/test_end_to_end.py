@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+import process
+from benchmarks import end_to_end
+from benchmarks.mock_service import Fixtures, MockService, label_boxes
+from util import computervision_api
+from util.cache import configure_cache, disable_cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def config(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    # the runs point the clients at their mock service, restore the endpoints after the test
+    monkeypatch.setattr(computervision_api, "VISION_ENDPOINT", computervision_api.VISION_ENDPOINT)
+    monkeypatch.setenv("FORM_RECOGNIZER_ENDPOINT", os.environ["FORM_RECOGNIZER_ENDPOINT"])
+    return process.load_config('1500.config.yaml')
+
+def settings(fixtures_dir):
+    return {'config': '1500.config.yaml', 'input': None, 'forms': 3, 'pages': process.DEFAULT_PAGES, 'workers': 1,
+            'batch_size': 2, 'latency': 0.0, 'analyze_latency': 0.1, 'throttle_rate': 0.0, 'retry_after': 1.0,
+            'seed': 0, 'fixtures': fixtures_dir}
+
+def test_fixtures_replay_recorded_results(config, tmp_path):
+    files = end_to_end.synthetic_forms(config, 3, str(tmp_path))
+
+    # record: a run with the result cache on, against a service that makes up its results
+    recorder = MockService(Fixtures(None, label_boxes(config)), latency=0.0, analyze_latency=0.1).start()
+    os.environ["FORM_RECOGNIZER_ENDPOINT"] = recorder.url
+    computervision_api.VISION_ENDPOINT = recorder.url
+    configure_cache(str(tmp_path / 'cache'))
+    try:
+        process.process_forms(files, config, 1, 2, str(tmp_path / 'recorded.csv'))
+    finally:
+        recorder.stop()
+        disable_cache()
+
+    # replay: the benchmark sends the same requests, each one gets its recorded result by hash
+    report = end_to_end.run(files, config, settings(str(tmp_path / 'cache')))
+    assert report['forms'] == 3
+    assert report['service']['formrec']['requests'] > 0
+    assert report['replayed'] == {'vision': report['service']['vision']['requests'],
+                                  'formrec': report['service']['formrec']['requests']}
@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+import pytest
+
+from benchmarks.mock_service import Fixtures, MockService
+from util import formrec_api
+from util.payload import encode_pdf
+from util.retry import RetryPolicy, ServiceError, configure_retry
+
+ANALYZE_LATENCY = 0.3
+
+@pytest.fixture
+def service(monkeypatch):
+    service = MockService(Fixtures(), latency=0.0, analyze_latency=ANALYZE_LATENCY).start()
+    monkeypatch.setenv("FORM_RECOGNIZER_ENDPOINT", service.url)
+    yield service
+    service.stop()
+
+def document(pages, value=0):
+    return encode_pdf([np.full((40, 120), value + page, dtype=np.uint8) for page in range(pages)])
+
+def test_next_poll_delay():
+    assert formrec_api.next_poll_delay({}) == formrec_api.POLL_INITIAL_DELAY
+    assert formrec_api.next_poll_delay({'Retry-After': '0.25'}) == 0.25
+    assert formrec_api.next_poll_delay({}, 2.0) == 2.0 * formrec_api.POLL_BACKOFF_FACTOR
+    assert formrec_api.next_poll_delay({}, formrec_api.POLL_MAX_DELAY) == formrec_api.POLL_MAX_DELAY
+    assert formrec_api.next_poll_delay({'Retry-After': '3'}, 2.0) == 3.0
+
+def test_analyze_document_rest_polls_after_retry_after(service):
+    started = time.monotonic()
+    result = formrec_api.analyze_document_rest(document(2), "prebuilt-read", "2023-07-31")
+    elapsed = time.monotonic() - started
+
+    assert [page['pageNumber'] for page in result['pages']] == [1, 2]
+    # the operation is polled when the service says it is done, not after a fixed interval
+    assert ANALYZE_LATENCY <= elapsed < ANALYZE_LATENCY + 0.5
+    assert service.stats['formrec']['requests'] == 1
+    assert service.stats['formrec_poll']['requests'] <= 2
+
+def test_analyze_documents_rest(service):
+    documents = [document(pages, value) for value, pages in enumerate((1, 3, 2))]
+    started = time.monotonic()
+    results = formrec_api.analyze_documents_rest(documents, "prebuilt-read", "2023-07-31", max_in_flight=2)
+    elapsed = time.monotonic() - started
+
+    assert [len(result['pages']) for result in results] == [1, 3, 2]
+    # two operations in flight at a time, each done after its Retry-After
+    assert elapsed < 2 * ANALYZE_LATENCY + 0.5
+    assert service.stats['formrec']['requests'] == 3
+
+def test_analyze_document_rest_deadline(service):
+    service.analyze_latency = 5.0
+    configure_retry(RetryPolicy(deadline=1.0))
+    try:
+        with pytest.raises(ServiceError, match="not finished within"):
+            formrec_api.analyze_document_rest(document(1), "prebuilt-read", "2023-07-31")
+    finally:
+        configure_retry(None)
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+import process
+from benchmarks import end_to_end
+from benchmarks.mock_service import Fixtures, MockService, label_boxes
+from util import computervision_api
+from util.journal import JobJournal, STAGE_ANALYZED, STAGE_DETECTED, STAGE_POSTPROCESSED
+from util.pipeline import Pipeline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def config(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(computervision_api, "VISION_ENDPOINT", computervision_api.VISION_ENDPOINT)
+    monkeypatch.setenv("FORM_RECOGNIZER_ENDPOINT", os.environ["FORM_RECOGNIZER_ENDPOINT"])
+    return process.load_config('1500.config.yaml')
+
+@pytest.fixture
+def service(config):
+    service = MockService(Fixtures(None, label_boxes(config)), latency=0.0, analyze_latency=0.05).start()
+    os.environ["FORM_RECOGNIZER_ENDPOINT"] = service.url
+    computervision_api.VISION_ENDPOINT = service.url
+    yield service
+    service.stop()
+
+def requests(service):
+    return {endpoint: stats['requests'] for endpoint, stats in service.stats.items() if endpoint != 'formrec_poll'}
+
+@pytest.fixture
+def journaled(config, service, tmp_path):
+    """
+    Processes two forms with a journal, returns the pipeline, the form pages, their records and the journal.
+    """
+    pipeline = Pipeline(config)
+    form_pages = [(file, 0) for file in end_to_end.synthetic_forms(config, 2, str(tmp_path))]
+    journal = JobJournal(str(tmp_path / 'journal.sqlite'), config)
+    records = process.process_batch(form_pages, pipeline, journal=journal)
+    assert all(record['error'] == '' for record in records)
+    assert requests(service) == {'vision': 2, 'formrec': 1}
+    yield pipeline, form_pages, records, journal
+    journal.close()
+
+def test_postprocessed_forms_return_their_record(journaled, service):
+    pipeline, form_pages, records, journal = journaled
+    stored = {**records[1], 'error': 'stored'}
+    journal.update(*form_pages[1], STAGE_POSTPROCESSED, record=stored)
+
+    assert process.process_batch(form_pages, pipeline, journal=journal) == [records[0], stored]
+    assert requests(service) == {'vision': 2, 'formrec': 1}
+
+@pytest.mark.parametrize('stage, vision, formrec', [(STAGE_ANALYZED, 0, 0), (STAGE_DETECTED, 0, 1)])
+def test_forms_continue_from_their_stage(journaled, service, stage, vision, formrec):
+    pipeline, form_pages, records, journal = journaled
+    for form_page in form_pages:
+        journal.update(*form_page, stage)
+
+    # analyzed forms are post-processed from their journaled words, detected forms are cropped from their journaled boxes
+    assert process.process_batch(form_pages, pipeline, journal=journal) == records
+    assert requests(service) == {'vision': 2 + vision, 'formrec': 1 + formrec}
+    assert [journal.get(*form_page)['stage'] for form_page in form_pages] == [STAGE_POSTPROCESSED] * 2
+
+def test_batch_of_forms_at_every_stage(journaled, service, config, tmp_path):
+    pipeline, form_pages, records, journal = journaled
+    journal.update(*form_pages[0], STAGE_ANALYZED)
+    journal.update(*form_pages[1], STAGE_DETECTED)
+    (tmp_path / 'new').mkdir()
+    form_pages = form_pages + [(end_to_end.synthetic_forms(config, 1, str(tmp_path / 'new'))[0], 0)]
+
+    results = process.process_batch(form_pages, pipeline, journal=journal)
+    assert results[:2] == records
+    assert results[2] == {**records[0], 'fileName': results[2]['fileName']}
+    # only the new form is detected, the detected and the new form share one analysis request
+    assert requests(service) == {'vision': 3, 'formrec': 2}
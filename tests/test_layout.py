@@ -0,0 +1,90 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from benchmarks.batch_requests import count_pages
+from util.layout import MOSAIC_GAP, MOSAIC_PAGE_HEIGHT, MOSAIC_PAGE_WIDTH, mosaic_layout, page_layout, split_words
+from util.payload import PAYLOAD_DPI, get_payload_encoder
+
+CROP_SETS = 300
+
+def random_crops(rng):
+    # field crops as the pipeline makes them, with now and then one larger than a mosaic page
+    count = int(rng.integers(1, 13))
+    crops = [np.full((int(rng.integers(30, 420)), int(rng.integers(40, 900))), 255, np.uint8) for _ in range(count)]
+    if rng.random() < 0.1:
+        crops.append(np.full((MOSAIC_PAGE_HEIGHT + 100, MOSAIC_PAGE_WIDTH + 50), 255, np.uint8))
+    return crops
+
+def random_words(rng, crop):
+    # words in inches from the top left corner of the crop; their centers may stick out of the crop by less than
+    # half the gap between crops, as words read on the border do
+    height, width = crop.shape[0] / PAYLOAD_DPI, crop.shape[1] / PAYLOAD_DPI
+    margin = (MOSAIC_GAP / 2 - 2) / np.sqrt(2) / PAYLOAD_DPI
+    words = []
+    for i in range(int(rng.integers(0, 6))):
+        x, y = rng.uniform(-margin, width + margin), rng.uniform(-margin, height + margin)
+        w, h = rng.uniform(0.01, 0.2), rng.uniform(0.01, 0.1)
+        polygon = [x - w, y - h, x + w, y - h, x + w, y + h, x - w, y + h]
+        words.append({'content': f'w{i}', 'polygon': polygon, 'confidence': 0.9})
+    return words
+
+def analyze_result(pages, slots, words, unit):
+    # the words of every crop on its page, in page inches (PDF pages) or pixels (image pages)
+    scale = PAYLOAD_DPI if unit == 'pixel' else 1
+    result_pages = [{'pageNumber': number, 'unit': unit, 'width': page.shape[1] / PAYLOAD_DPI * scale,
+                     'height': page.shape[0] / PAYLOAD_DPI * scale, 'words': []} for number, page in enumerate(pages, 1)]
+    for slot, crop_words in zip(slots, words):
+        left, top = slot.left / PAYLOAD_DPI, slot.top / PAYLOAD_DPI
+        for word in crop_words:
+            polygon = [(value + (left if j % 2 == 0 else top)) * scale for j, value in enumerate(word['polygon'])]
+            result_pages[slot.page_number-1]['words'].append({**word, 'polygon': polygon})
+    return {'pages': result_pages}
+
+def assert_same_words(actual, expected):
+    assert [word['content'] for word in actual] == [word['content'] for word in expected]
+    for actual_word, expected_word in zip(actual, expected):
+        assert actual_word['polygon'] == pytest.approx(expected_word['polygon'], abs=1e-9)
+
+@pytest.mark.parametrize('payload_format, unit', [('pdf', 'inch'), ('tiff-g4', 'pixel')])
+@pytest.mark.parametrize('layout', [mosaic_layout, page_layout])
+def test_words_round_trip(layout, payload_format, unit):
+    rng = np.random.default_rng(20)
+    encode = get_payload_encoder(payload_format)
+    for crop_set in range(CROP_SETS):
+        crops = random_crops(rng)
+        pages, slots = layout(crops)
+
+        # every crop is on its page, inside it and apart from the others
+        for slot, crop in zip(slots, crops):
+            page = pages[slot.page_number-1]
+            assert (slot.height, slot.width) == crop.shape
+            assert slot.left + slot.width <= page.shape[1] and slot.top + slot.height <= page.shape[0]
+        for i, a in enumerate(slots):
+            for b in slots[i+1:]:
+                if a.page_number == b.page_number:
+                    assert (a.left + a.width + MOSAIC_GAP <= b.left or b.left + b.width + MOSAIC_GAP <= a.left
+                            or a.top + a.height + MOSAIC_GAP <= b.top or b.top + b.height + MOSAIC_GAP <= a.top)
+
+        words = [random_words(rng, crop) for crop in crops]
+        for actual, expected in zip(split_words(analyze_result(pages, slots, words, unit), slots), words):
+            assert_same_words(actual, expected)
+
+        if crop_set < 5:
+            # the document has the pages of the layout, at their size
+            document = encode(pages)
+            assert count_pages(document) == len(pages)
+            if unit == 'pixel':
+                image = Image.open(BytesIO(document))
+                for number, page in enumerate(pages):
+                    image.seek(number)
+                    assert image.size == (page.shape[1], page.shape[0])
+
+def test_missing_page():
+    crops = [np.full((1000, 1600), 255, np.uint8) for _ in range(3)]
+    pages, slots = mosaic_layout(crops)
+    assert [slot.page_number for slot in slots] == [1, 1, 2]
+    result = {'pages': [{'pageNumber': 1, 'unit': 'inch', 'words': []}]}
+    assert split_words(result, slots) == [[], [], None]
@@ -0,0 +1,56 @@
+import csv
+
+import pytest
+
+from util.output import CsvSink, drop_failed, drop_partial_row, read_processed
+
+HEADER = ['fileName', 'pageNumber', 'charges_1', 'error']
+
+def record(page, error=''):
+    return {'fileName': 'a.pdf', 'pageNumber': page, 'charges_1': f'{page}.00', 'error': error}
+
+def read_rows(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+def write_rows(path, records):
+    with CsvSink(str(path), HEADER, flush_every=1) as sink:
+        for row in records:
+            sink.write(row)
+
+def resume(path, pages):
+    # what process_forms does with an existing output file
+    drop_failed(str(path))
+    processed = read_processed(str(path))
+    write_rows(path, [record(page) for page in pages if ('a.pdf', str(page)) not in processed])
+
+@pytest.mark.parametrize('cut', [1, 5, 12, -2, -1])
+def test_resume_after_a_cut_row(tmp_path, cut):
+    path = tmp_path / 'output.csv'
+    write_rows(path, [record(1), record(2), record(3)])
+    data = path.read_bytes()
+    last_row = data.rindex(b'a.pdf')
+    # killed while the last row was being written: cut inside it, or between its \r and \n
+    path.write_bytes(data[:last_row + cut] if cut > 0 else data[:cut])
+
+    resume(path, [1, 2, 3, 4])
+    rows = read_rows(path)
+    assert [row['pageNumber'] for row in rows] == ['1', '2', '3', '4']
+    assert all(row == {key: str(value) for key, value in record(int(row['pageNumber'])).items()} for row in rows)
+    assert path.read_bytes().endswith(b'\r\n') and b'\r\r' not in path.read_bytes()
+
+def test_cut_error_row_is_processed_again(tmp_path):
+    path = tmp_path / 'output.csv'
+    write_rows(path, [record(1), record(2, 'Analyze request failed (500): "boom, again"')])
+    path.write_bytes(path.read_bytes()[:-8])
+
+    resume(path, [1, 2])
+    assert [(row['pageNumber'], row['error']) for row in read_rows(path)] == [('1', ''), ('2', '')]
+
+def test_complete_file_is_unchanged(tmp_path):
+    path = tmp_path / 'output.csv'
+    write_rows(path, [record(1), record(2)])
+    data = path.read_bytes()
+    assert not drop_partial_row(str(path))
+    assert path.read_bytes() == data
+    assert read_processed(str(path)) == {('a.pdf', '1'), ('a.pdf', '2')}
@@ -0,0 +1,32 @@
+import copy
+import importlib
+import json
+import os
+
+import pytest
+
+from util.pipeline import POSTPROCESSING_PACKAGE
+from util.post_processing import WordLines, count_words_in_line, sort_words
+
+# analysis words of field crops and the records the 1500 modules made of them before WordLines
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'postprocessing_golden.json')
+
+with open(GOLDEN_FILE) as f:
+    GOLDEN = json.load(f)
+
+@pytest.mark.parametrize('module_name', sorted(GOLDEN))
+def test_modules_match_golden_records(module_name):
+    module = importlib.import_module(f"{POSTPROCESSING_PACKAGE}.{module_name}")
+    for case in GOLDEN[module_name]:
+        assert module.run(copy.deepcopy(case['field'])) == case['record']
+
+@pytest.mark.parametrize('line_threshold', [0.03, 0.06, 5])
+def test_word_lines_match_sort_words(line_threshold):
+    for cases in GOLDEN.values():
+        for case in cases:
+            words = case['field']['analysis']['words']
+            lines = WordLines(words, line_threshold)
+            sorted_words = sort_words(words, line_threshold)
+            assert lines.words == sorted_words
+            for line_number in range(len(lines.line_counts) + 2):
+                assert lines.count_words_in_line(line_number) == count_words_in_line(sorted_words, line_number, line_threshold)
@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+import pytest
+
+from benchmarks.remove_blobs import add_specks, remove_blobs_loop, synthetic_crop
+from util.pre_processing import denoise, remove_blobs, remove_hlines
+
+def denoise_chain(gray, large_blob_area, small_blob_area):
+    # the chain denoise replaces, as it ran in crop
+    cropped = remove_blobs(gray, large_blob_area)
+    cropped = remove_hlines(cropped)
+    cropped = remove_blobs(cropped, small_blob_area)
+    return remove_hlines(cropped)
+
+def crops():
+    rng = np.random.default_rng(10)
+    crops = [add_specks(synthetic_crop(rng), 300, rng) for _ in range(4)]
+    crops.append(add_specks(synthetic_crop(rng, 60, 700), 80, rng))
+    # gray scan background with a thick line across the text
+    scan = np.clip(synthetic_crop(rng).astype(np.int16) - rng.integers(0, 60, (390, 400)), 0, 255).astype(np.uint8)
+    cv2.line(scan, (0, 200), (400, 200), 40, 4)
+    crops.append(scan)
+    crops.append(np.full((80, 200), 255, np.uint8))
+    return crops
+
+CROPS = crops()
+
+@pytest.mark.parametrize('index', range(len(CROPS)))
+@pytest.mark.parametrize('large_blob_area, small_blob_area', [(40, 10), (80, 20)])
+def test_denoise_matches_chain(index, large_blob_area, small_blob_area):
+    crop = CROPS[index]
+    expected = denoise_chain(crop.copy(), large_blob_area, small_blob_area)
+    actual = denoise(crop.copy(), large_blob_area, small_blob_area)
+    assert actual.shape == expected.shape and actual.dtype == expected.dtype
+    assert np.array_equal(actual, expected)
+
+@pytest.mark.parametrize('specks', [0, 100, 300, 1000])
+@pytest.mark.parametrize('area_threshold', [40, 10])
+def test_remove_blobs_matches_loop(specks, area_threshold):
+    rng = np.random.default_rng(specks)
+    for crop in (synthetic_crop(rng), synthetic_crop(rng, 60, 700)):
+        noisy = add_specks(crop, specks, rng)
+        expected = remove_blobs_loop(noisy.copy(), area_threshold)
+        actual = remove_blobs(noisy.copy(), area_threshold)
+        assert actual.shape == expected.shape and actual.dtype == expected.dtype
+        assert np.array_equal(actual, expected)
@@ -0,0 +1,55 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import process
+from benchmarks.batch_requests import detection_result, synthetic_page
+from benchmarks.mock_service import label_boxes
+from benchmarks.remove_blobs import add_specks
+from util.pipeline import Pipeline
+from util.pre_processing import crop, crop_box, denoise, index_detections
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.mark.parametrize('pages', ['0', '3-2', 'first'])
+def test_invalid_pages_fail_before_the_output_file(pages, monkeypatch, tmp_path):
+    monkeypatch.chdir(ROOT)
+    config = process.load_config('1500.config.yaml')
+    output_file = tmp_path / 'output.csv'
+    with pytest.raises(ValueError):
+        process.process_forms([], config, 1, None, str(output_file), pages=pages)
+    assert not output_file.exists()
+
+def test_parse_pages():
+    assert process.parse_pages('1,3-5') == [(1, 1), (3, 5)]
+    assert process.parse_pages('2-') == [(2, None)]
+
+def test_preprocess_fields_matches_per_field_denoising(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    config = process.load_config('1500.config.yaml')
+    boxes = label_boxes(config)
+    page = synthetic_page(boxes)
+    detection = detection_result(boxes)
+    fields = Pipeline(config).fields
+    # two-tone page, gray from the left of end_date, and specks: the threshold and blobs of a crop depend on its columns
+    (_, _, end_date_left, _), _, _ = crop_box(index_detections(detection), fields[4].cropping, page.shape)
+    page[:, end_date_left:] = np.clip(page[:, end_date_left:].astype(np.int16) - 90, 0, 255)
+    page = cv2.cvtColor(add_specks(cv2.cvtColor(page, cv2.COLOR_BGR2GRAY), 3000, np.random.default_rng(0)), cv2.COLOR_GRAY2BGR)
+    # a field with the same box as start_date shares its denoised crop
+    fields = fields + (fields[3]._replace(name='start_date_copy'),)
+
+    denoised = []
+    monkeypatch.setattr(process, 'denoise', lambda *args: denoised.append(args) or denoise(*args))
+    crops = process.preprocess_fields(page, detection, fields)
+    assert len(denoised) == sum(field.remove_noise for field in fields) - 1
+
+    for field, (cropped, confidence, found) in zip(fields, crops):
+        expected, expected_confidence, expected_found = crop(page, detection, field.cropping)
+        expected = cv2.cvtColor(expected, cv2.COLOR_BGR2GRAY)
+        if field.remove_noise:
+            expected = denoise(expected, 40, 10)
+        expected = cv2.copyMakeBorder(expected, 10, 10, 10, 10, cv2.BORDER_CONSTANT, value=[255, 255, 255])
+        assert (confidence, found) == (expected_confidence, expected_found)
+        assert np.array_equal(cropped, expected), field.name
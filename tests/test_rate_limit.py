@@ -0,0 +1,57 @@
+import asyncio
+import threading
+import time
+
+from util.rate_limit import RateLimiter
+
+def limiter(max_concurrency=4):
+    return RateLimiter('test', rate=1000.0, max_concurrency=max_concurrency)
+
+def test_concurrency_grows_on_responses_only():
+    rate_limiter = limiter()
+    rate_limiter.concurrency = 2.0
+
+    rate_limiter.acquire()
+    assert rate_limiter.release(None) is False
+    assert rate_limiter.concurrency == 2.0
+
+    rate_limiter.acquire()
+    assert rate_limiter.release(200) is False
+    assert rate_limiter.concurrency == 2.5
+
+    rate_limiter.acquire()
+    assert rate_limiter.release(429, {'Retry-After': '0'}) is True
+    assert rate_limiter.concurrency == 1.25
+    assert rate_limiter.in_flight == 0
+
+def test_acquire_waits_for_a_release():
+    rate_limiter = limiter(max_concurrency=1)
+    rate_limiter.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (rate_limiter.acquire(), acquired.set()))
+    waiter.start()
+
+    assert not acquired.wait(0.2)
+    released = time.monotonic()
+    rate_limiter.release(200)
+    assert acquired.wait(1.0)
+    # woken by the release, not by a timer
+    assert time.monotonic() - released < 0.05
+    waiter.join()
+    assert rate_limiter.in_flight == 1
+    assert rate_limiter.stats()['queue_wait'] >= 0.2
+
+def test_acquire_async_waits_for_a_release():
+    rate_limiter = limiter(max_concurrency=1)
+    rate_limiter.acquire()
+
+    async def wait_for_slot():
+        task = asyncio.ensure_future(rate_limiter.acquire_async())
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        # released by another thread, as the sync clients do
+        threading.Thread(target=rate_limiter.release, args=(200,)).start()
+        await asyncio.wait_for(task, 1.0)
+
+    asyncio.run(wait_for_slot())
+    assert rate_limiter.in_flight == 1
@@ -0,0 +1,163 @@
+import asyncio
+import csv
+import os
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import process
+from benchmarks import end_to_end
+from benchmarks.mock_service import Fixtures, MockService, label_boxes
+from util import computervision_api, http_client
+from util.retry import RetryPolicy, ServiceError, configure_retry
+
+@pytest.fixture
+def short_retries():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.05, max_retry_time=1.0, deadline=5.0)
+    configure_retry(policy)
+    yield policy
+    configure_retry(None)
+
+@pytest.fixture
+def scripted():
+    """
+    A service answering its requests with the statuses of a script, in order, then 200.
+    """
+    class Service:
+        statuses = []
+        requests = 0
+
+    service = Service()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            status = service.statuses[service.requests] if service.requests < len(service.statuses) else 200
+            service.requests += 1
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service.url = f"http://127.0.0.1:{server.server_address[1]}/"
+    yield service
+    server.shutdown()
+    server.server_close()
+
+def closed_port_url():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/"
+
+def test_next_delay_is_jittered_under_the_backoff():
+    random.seed(22)
+    policy = RetryPolicy(max_attempts=20, base_delay=0.01, max_delay=0.1, max_retry_time=100, deadline=100)
+    for _ in range(50):
+        budget = policy.start()
+        delays = []
+        while True:
+            attempt = budget.attempt
+            delay = budget.next_delay()
+            if delay is None:
+                break
+            assert 0 <= delay <= min(policy.max_delay, policy.base_delay * 2**attempt)
+            delays.append(delay)
+        assert len(delays) == budget.retries == policy.max_attempts - 1
+        assert budget.retry_time == pytest.approx(sum(delays))
+    # full jitter: first delays spread over the whole range, not near its top
+    delays = [policy.start().next_delay() for _ in range(200)]
+    assert min(delays) < 0.25 * policy.base_delay * 2 and max(delays) > 0.75 * policy.base_delay * 2
+
+def test_next_delay_stops_at_max_attempts():
+    budget = RetryPolicy(max_attempts=3, base_delay=0.01, max_retry_time=100, deadline=100).start()
+    assert budget.next_delay() is not None and budget.next_delay() is not None
+    assert budget.next_delay() is None
+    assert (budget.attempt, budget.retries) == (3, 2)
+
+def test_next_delay_stops_at_max_retry_time():
+    budget = RetryPolicy(max_attempts=10, max_retry_time=1.0, deadline=100).start()
+    assert [budget.next_delay(0.4), budget.next_delay(0.4)] == [0.4, 0.4]
+    # a third wait would take the retries over a second
+    assert budget.next_delay(0.4) is None
+    assert budget.next_delay(0.2) == 0.2
+
+def test_deadline_shortens_the_timeouts():
+    budget = RetryPolicy(deadline=0.3).start()
+    connect, read = budget.timeout(5, 60)
+    assert 0 < connect <= 0.3 and 0 < read <= 0.3
+    assert budget.timeout(0.1, 0.2) == (0.1, 0.2)
+    # no wait that ends after the deadline
+    assert budget.next_delay(0.5) is None
+    time.sleep(0.3)
+    with pytest.raises(ServiceError, match="Deadline"):
+        budget.timeout(5, 60)
+
+@pytest.mark.parametrize('statuses, status, requests', [
+    ([500], 200, 2), ([502, 503], 200, 3), ([408], 200, 2),
+    # out of attempts, the last response is returned
+    ([504, 504, 504, 504], 504, 3),
+    # client errors are not retried
+    ([400], 400, 1), ([404], 404, 1), ([413], 413, 1),
+])
+def test_retryable_statuses(short_retries, scripted, statuses, status, requests):
+    scripted.statuses = statuses
+    response = http_client.get(scripted.url, endpoint='scripted')
+    assert (response.status_code, scripted.requests) == (status, requests)
+
+@pytest.mark.parametrize('statuses, status, requests', [([503], 200, 2), ([408, 408, 408], 408, 3), ([401], 401, 1)])
+def test_retryable_statuses_async(short_retries, scripted, statuses, status, requests):
+    scripted.statuses = statuses
+
+    async def get():
+        async with http_client.create_async_session() as session:
+            return await http_client.request_async(session, 'GET', scripted.url, endpoint='scripted')
+
+    assert asyncio.run(get())[0] == status
+    assert scripted.requests == requests
+
+def test_connection_errors_are_retried(short_retries):
+    started = time.monotonic()
+    with pytest.raises(ServiceError, match="failed after 3 attempts"):
+        http_client.get(closed_port_url(), endpoint='scripted')
+    # three attempts and two short waits, within the retry time
+    assert time.monotonic() - started < short_retries.max_retry_time
+
+def test_failed_forms_are_processed_again(short_retries, monkeypatch, tmp_path):
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    monkeypatch.setattr(computervision_api, "VISION_ENDPOINT", computervision_api.VISION_ENDPOINT)
+    monkeypatch.setenv("FORM_RECOGNIZER_ENDPOINT", os.environ["FORM_RECOGNIZER_ENDPOINT"])
+    config = process.load_config('1500.config.yaml')
+    files = end_to_end.synthetic_forms(config, 2, str(tmp_path))
+    output_file = str(tmp_path / 'output.csv')
+
+    def read_rows():
+        with open(output_file, newline='') as f:
+            return list(csv.DictReader(f))
+
+    service = MockService(Fixtures(None, label_boxes(config)), latency=0.0, analyze_latency=0.05).start()
+    computervision_api.VISION_ENDPOINT = service.url
+    try:
+        # the document analysis service is down: the forms get an error row
+        os.environ["FORM_RECOGNIZER_ENDPOINT"] = closed_port_url()
+        process.process_forms(files, config, 1, 2, output_file)
+        rows = read_rows()
+        assert [row['fileName'] for row in rows] == [os.path.basename(file) for file in files]
+        assert all(row['error'].startswith('analysis:') for row in rows)
+
+        # it is back: the resumed run drops the error rows and processes the forms again
+        os.environ["FORM_RECOGNIZER_ENDPOINT"] = service.url
+        process.process_forms(files, config, 1, 2, output_file)
+    finally:
+        service.stop()
+    rows = read_rows()
+    assert [row['fileName'] for row in rows] == [os.path.basename(file) for file in files]
+    assert all(row['error'] == '' for row in rows)
+    assert service.stats['formrec']['requests'] == 1
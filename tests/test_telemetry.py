@@ -0,0 +1,20 @@
+import json
+
+from util import telemetry
+
+def test_spans_file_is_closed_on_shutdown(tmp_path):
+    spans_file = tmp_path / 'spans.jsonl'
+    telemetry.configure_tracing(str(spans_file))
+    out = telemetry._spans_out
+    with telemetry.span('batch', forms=2):
+        pass
+    telemetry.shutdown_tracing()
+    assert out.closed and telemetry._spans_out is None
+    assert [json.loads(line)['name'] for line in spans_file.read_text().splitlines()] == ['batch']
+
+def test_reconfiguring_closes_the_previous_spans_file(tmp_path):
+    telemetry.configure_tracing(str(tmp_path / 'first.jsonl'))
+    first = telemetry._spans_out
+    telemetry.configure_tracing(str(tmp_path / 'second.jsonl'))
+    assert first.closed and not telemetry._spans_out.closed
+    telemetry.shutdown_tracing()
@@ -0,0 +1,164 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from util.telemetry import count_cache
+
+# globals
+DEFAULT_CACHE_DIR = 'work/cache'
+DEFAULT_CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 1024**3))
+# after an eviction the cache is trimmed to this fraction of its maximum size
+EVICTION_TARGET = 0.9
+
+_cache = None
+
+# -----------------------------
+#   CLASSES
+# -----------------------------
+
+class ResultCache:
+    """
+    On-disk, content-addressed cache of API results.
+
+    Each result is stored as a JSON file named after the sha256 of the request (the bytes sent plus the model
+    and API version), so re-running the same forms with a different cropping or post-processing configuration
+    does not call the services again for requests that did not change. When the files exceed max_bytes the least
+    recently used ones are removed (file modification time is refreshed on every hit).
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if not os.path.exists(cache_dir): os.makedirs(cache_dir)
+        self._size = sum(size for _, _, size in self._entries())
+
+    @staticmethod
+    def key(kind, *parts):
+        """
+        Builds the cache key of a request from its kind ('vision', 'formrec', ...) and its parts (bytes or str).
+        """
+        digest = hashlib.sha256(kind.encode())
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode()
+            # length prefix keeps ('ab', 'c') and ('a', 'bc') apart
+            digest.update(len(part).to_bytes(8, 'little'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.json'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, stat.st_mtime, stat.st_size
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f)
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        data = json.dumps(value).encode()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so concurrent readers never see a partial result
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += len(data) - previous_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        target = self.max_bytes * EVICTION_TARGET
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+        removed = 0
+        for path, _, size in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+            removed += 1
+        logging.info(f"Cache eviction removed {removed} entries ({self.cache_dir})")
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def configure_cache(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    """
+    Enables the result cache used by object_detection_rest and analyze_document_rest.
+    """
+    global _cache
+    _cache = ResultCache(cache_dir, max_bytes)
+    return _cache
+
+def disable_cache():
+    global _cache
+    _cache = None
+
+def get_cache():
+    """
+    Returns the configured result cache, or None when caching is disabled (the default).
+    """
+    return _cache
+
+def get_cached(kind, *parts):
+    """
+    Looks up a request in the configured cache.
+
+    Returns:
+    key (str): The cache key of the request, or None when caching is disabled.
+    value (dict): The cached result, or None on a miss.
+    """
+    cache = _cache
+    if cache is None:
+        return None, None
+    key = cache.key(kind, *parts)
+    value = cache.get(key)
+    count_cache(kind, value is not None)
+    return key, value
+
+def set_cached(key, value):
+    """
+    Stores a result under a key returned by get_cached. Does nothing when caching is disabled.
+    """
+    cache = _cache
+    if cache is not None and key is not None:
+        cache.put(key, value)
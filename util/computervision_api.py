@@ -4,14 +4,18 @@
 # Import the necessary packages
 import os
 import cv2
-import requests
 import json
+from util import http_client
+from util.cache import get_cached, set_cached
+from util.retry import ServiceError
+from util.telemetry import span
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # globals
 FORM_REC_API_VERSION = "2023-07-31"
+VISION_API_VERSION = "2023-02-01-preview"
 VISION_ENDPOINT=os.environ["VISION_ENDPOINT"]
 VISION_KEY = os.environ["VISION_KEY"]
 QR_CODE_MODEL_NAME = "qrcode01"
@@ -33,30 +37,41 @@ def object_detection_rest(image_data, model):
     Parameters:
     None
 
+    Failed requests are retried according to the retry policy (see util.retry).
+
     Returns:
     A list of dictionaries. Each dictionary contains 'label' and 'bounding_box' keys.
     'label' is a string that represents the object's name.
     'bounding_box' is a dictionary with 'x', 'y', 'width', and 'height' keys that represent the object's location and size in the image.
+
+    Raises:
+    - ServiceError: If the request failed once its retries ran out.
     """
 
+    # Same image, model and api version: reuse the cached result
+    cache_key, result = get_cached("vision", image_data, model, VISION_API_VERSION)
+    if result is not None:
+        return result
+
     # Request headers
     headers = {
         "Content-Type": "application/octet-stream",
         "Ocp-Apim-Subscription-Key": VISION_KEY
     }
 
-    request_endpoint = f"{VISION_ENDPOINT}computervision/imageanalysis:analyze?api-version=2023-02-01-preview&model-name={model}"
+    request_endpoint = f"{VISION_ENDPOINT}computervision/imageanalysis:analyze?api-version={VISION_API_VERSION}&model-name={model}"
     
     # Send request
-    response = requests.post(request_endpoint, headers=headers, data=image_data)
+    with span("object_detection", model=model, bytes=len(image_data)):
+        response = http_client.post(request_endpoint, endpoint="vision", headers=headers, data=image_data)
 
     # Parse response
-    if response.status_code in (200, 202):
-        result = json.loads(response.text)
-    else:
+    if response.status_code not in (200, 202):
         # Request failed
-        print("Error request: ", response.text)
-        exit()
+        raise ServiceError(f"Object detection request failed ({response.status_code}): {response.text}", response.status_code)
+    result = json.loads(response.text)
+
+    set_cached(cache_key, result)
 
     return result
 
@@ -70,6 +85,9 @@ def crop_from_qrcode(input_image):
     Returns:
         Optional[np.ndarray]: The cropped image as a NumPy array, or None if no QR code was found.
     """
+    # the Vision SDK is only needed here, the detection calls of the pipeline use the REST API
+    import azure.ai.vision as sdk
+
     service_options = sdk.VisionServiceOptions(os.environ["VISION_ENDPOINT"], os.environ["VISION_KEY"])
     vision_source = sdk.VisionSource(filename=input_image)
     analysis_options = sdk.ImageAnalysisOptions()
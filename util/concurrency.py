@@ -0,0 +1,53 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+from collections import deque
+from itertools import islice
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def ordered_map(executor, fn, iterable, max_pending):
+    """
+    Maps a function over an iterable using an executor, yielding the results in input order.
+
+    Unlike Executor.map, items are submitted lazily: at most max_pending calls are in flight (or waiting
+    to be consumed) at any time, so a very long input does not queue every task upfront.
+
+    Parameters:
+    executor (concurrent.futures.Executor): The executor used to run the calls.
+    fn (callable): The function to apply to each item.
+    iterable (iterable): The items to process.
+    max_pending (int): The maximum number of submitted calls whose results have not been yielded yet.
+
+    Returns:
+    generator: The results of fn, in the same order as the items of the iterable.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def batched(iterable, size):
+    """
+    Yields lists of up to size consecutive items of an iterable, consuming it lazily.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def run_stage(pool, fn, *args):
+    """
+    Runs a pipeline stage in the given process pool, or inline when no pool is provided.
+    """
+    if pool is None:
+        return fn(*args)
+    return pool.submit(fn, *args).result()
@@ -0,0 +1,243 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import json
+import logging
+import os
+import threading
+import cv2
+import numpy as np
+from util.computervision_api import object_detection_rest
+
+# globals
+VISION_MODEL_ENV_VAR = "VISION_MODEL"
+DEFAULT_BACKEND = "azure"
+DEFAULT_DETECTION_BATCH_SIZE = 8
+DEFAULT_SCORE_THRESHOLD = 0.1
+# template registration
+REGISTRATION_WIDTH = 850
+REGISTRATION_FEATURES = 3000
+MATCH_RATIO = 0.75
+RANSAC_THRESHOLD = 3.0
+DEFAULT_MIN_INLIERS = 60
+DEFAULT_MIN_INLIER_RATIO = 0.3
+DEFAULT_BOX_CONFIDENCE = 1.0
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+# -----------------------------
+#   CLASSES
+# -----------------------------
+
+class AzureVisionDetector:
+    """
+    Detects the field labels with the Azure custom Vision model named by VISION_MODEL (one request per page).
+    """
+    needs_encoded_image = True
+    batch_size = 1
+
+    def __init__(self, config):
+        self.model = config.get('model') or os.environ.get(VISION_MODEL_ENV_VAR)
+
+    def detect(self, images, encoded_images):
+        return [object_detection_rest(encoded_image, self.model) for encoded_image in encoded_images]
+
+class OnnxDetector:
+    """
+    Detects the field labels with a detector exported to ONNX from the custom Vision project, running locally on CPU.
+
+    The model follows the custom Vision export format: a BGR float image_tensor input of fixed size and
+    detected_boxes (normalized x1, y1, x2, y2), detected_scores and detected_classes outputs. Pages are resized to
+    the model input and run in batches of batch_size when the model has a dynamic batch dimension.
+
+    Raises:
+    - ValueError: If the model input has no fixed image size (a dynamic height or width).
+    """
+    needs_encoded_image = False
+
+    def __init__(self, config):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(config['model_path'], providers=['CPUExecutionProvider'])
+        with open(config['labels_path'], 'r') as f:
+            self.labels = [line.strip() for line in f if line.strip()]
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        if len(model_input.shape) != 4 or not all(isinstance(size, int) for size in model_input.shape[1:]):
+            raise ValueError(f"The ONNX model input {self.input_name} must have a fixed image size (shape N x 3 x height x width), "
+                             f"got {model_input.shape}")
+        self.input_height, self.input_width = model_input.shape[2], model_input.shape[3]
+        # a fixed batch dimension (usually 1) means one page per run
+        self.batch_size = config.get('batch_size', DEFAULT_DETECTION_BATCH_SIZE) if not isinstance(model_input.shape[0], int) else model_input.shape[0]
+        self.score_threshold = config.get('score_threshold', DEFAULT_SCORE_THRESHOLD)
+        self.output_names = ['detected_boxes', 'detected_scores', 'detected_classes']
+
+    def preprocess(self, image):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        resized = cv2.resize(image, (self.input_width, self.input_height), interpolation=cv2.INTER_AREA)
+        # pages are RGB, the model expects BGR in NCHW layout
+        return resized[:, :, ::-1].transpose(2, 0, 1).astype(np.float32)
+
+    def to_result(self, boxes, scores, classes, image_shape):
+        height, width = image_shape[:2]
+        values = []
+        for (x1, y1, x2, y2), score, label in zip(boxes, scores, classes):
+            if score < self.score_threshold:
+                continue
+            values.append({
+                'boundingBox': {'x': int(round(x1*width)), 'y': int(round(y1*height)), 'w': int(round((x2-x1)*width)), 'h': int(round((y2-y1)*height))},
+                'tags': [{'name': self.labels[int(label)], 'confidence': float(score)}]
+            })
+        return {'customModelResult': {'objectsResult': {'values': values}}}
+
+    def detect(self, images, encoded_images=None):
+        results = []
+        for start in range(0, len(images), self.batch_size):
+            batch = images[start:start+self.batch_size]
+            inputs = np.stack([self.preprocess(image) for image in batch])
+            boxes, scores, classes = self.session.run(self.output_names, {self.input_name: inputs})
+            for i, image in enumerate(batch):
+                results.append(self.to_result(boxes[i], scores[i], classes[i], image.shape))
+        return results
+
+class TemplateDetector:
+    """
+    Derives the field boxes from a reference 1500 template instead of detecting them, falling back to another detector.
+
+    Each page is aligned to the template image with ORB feature matching and a RANSAC similarity transform; the
+    label boxes stored in template coordinates are then mapped onto the page. Pages whose alignment has too few
+    inliers (skewed scans, other layouts, poor quality) are sent to the fallback detector.
+    """
+    needs_encoded_image = False
+
+    def __init__(self, config, fallback):
+        self.fallback = fallback
+        self.batch_size = fallback.batch_size
+        self.boxes = config['boxes']
+        self.min_inliers = config.get('min_inliers', DEFAULT_MIN_INLIERS)
+        self.min_inlier_ratio = config.get('min_inlier_ratio', DEFAULT_MIN_INLIER_RATIO)
+        self.box_confidence = config.get('box_confidence', DEFAULT_BOX_CONFIDENCE)
+        self.aligned = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+        template = cv2.imread(config['image'], cv2.IMREAD_GRAYSCALE)
+        if template is None:
+            raise FileNotFoundError(f"Template image not found: {config['image']}")
+        self.template_keypoints, self.template_descriptors = self.features(template)
+
+    def features(self, gray):
+        # features are computed on a downscaled page, the scale is undone on the keypoint coordinates
+        scale = REGISTRATION_WIDTH / gray.shape[1]
+        small = cv2.resize(gray, (REGISTRATION_WIDTH, int(round(gray.shape[0]*scale))), interpolation=cv2.INTER_AREA)
+        orb = cv2.ORB_create(nfeatures=REGISTRATION_FEATURES)
+        keypoints, descriptors = orb.detectAndCompute(small, None)
+        points = np.float32([keypoint.pt for keypoint in keypoints]) / scale
+        return points, descriptors
+
+    def align(self, image):
+        """
+        Returns the 2x3 transform from template to page coordinates, or None when the alignment is not confident.
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+        points, descriptors = self.features(gray)
+        if descriptors is None or self.template_descriptors is None:
+            return None
+        matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+        good = [pair[0] for pair in matcher.knnMatch(self.template_descriptors, descriptors, k=2)
+                if len(pair) == 2 and pair[0].distance < MATCH_RATIO*pair[1].distance]
+        if len(good) < self.min_inliers:
+            return None
+        source = np.float32([self.template_keypoints[match.queryIdx] for match in good])
+        destination = np.float32([points[match.trainIdx] for match in good])
+        transform, inliers = cv2.estimateAffinePartial2D(source, destination, method=cv2.RANSAC, ransacReprojThreshold=RANSAC_THRESHOLD)
+        if transform is None:
+            return None
+        inlier_count = int(inliers.sum())
+        if inlier_count < self.min_inliers or inlier_count / len(good) < self.min_inlier_ratio:
+            return None
+        return transform
+
+    def to_result(self, transform, image_shape):
+        # the transform maps template pixels to page pixels, whatever the width of the template image
+        height, width = image_shape[:2]
+        values = []
+        for label, (x, y, w, h) in self.boxes.items():
+            corners = np.float32([[x, y], [x+w, y], [x+w, y+h], [x, y+h]]).reshape(-1, 1, 2)
+            mapped = cv2.transform(corners, transform).reshape(-1, 2)
+            left, top = np.maximum(mapped.min(axis=0), 0)
+            right, bottom = np.minimum(mapped.max(axis=0), (width, height))
+            values.append({
+                'boundingBox': {'x': int(round(left)), 'y': int(round(top)), 'w': int(round(right-left)), 'h': int(round(bottom-top))},
+                'tags': [{'name': label, 'confidence': self.box_confidence}]
+            })
+        return {'customModelResult': {'objectsResult': {'values': values}}}
+
+    def detect(self, images, encoded_images=None):
+        results = [None] * len(images)
+        fallback = []
+        for i, image in enumerate(images):
+            transform = self.align(image)
+            if transform is None:
+                fallback.append(i)
+            else:
+                results[i] = self.to_result(transform, image.shape)
+        with self._lock:
+            self.aligned += len(images) - len(fallback)
+            self.fallbacks += len(fallback)
+
+        if len(fallback) > 0:
+            logging.info(f"Template alignment not confident for {len(fallback)} of {len(images)} pages, using the {type(self.fallback).__name__}")
+            fallback_encoded = None
+            if self.fallback.needs_encoded_image:
+                fallback_encoded = [encoded_images[i] if encoded_images and encoded_images[i] is not None else cv2.imencode('.jpg', images[i])[1].tobytes() for i in fallback]
+            for i, result in zip(fallback, self.fallback.detect([images[i] for i in fallback], fallback_encoded)):
+                results[i] = result
+        return results
+
+DETECTORS = {
+    'azure': AzureVisionDetector,
+    'onnx': OnnxDetector
+}
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def get_detector(config):
+    """
+    Returns the detector selected by the 'detection' section of the config (the Azure custom Vision model when
+    there is none). Detectors are created once per process and reused.
+
+    When detection.template.enabled is set, boxes are derived from the aligned template and the backend is only
+    used for the pages that could not be aligned confidently. The template boxes must then cover the cropping label
+    of every field, as aligned pages get no other box.
+
+    All detectors take lists of page images (and their JPEG encoding when needs_encoded_image is set) and return,
+    for each page, a result in the custom Vision format used by crop: customModelResult.objectsResult.values.
+
+    Raises:
+    - ValueError: If the backend is unknown, or the template boxes miss the label of a field.
+    """
+    detection_config = config.get('detection') or {}
+    backend = detection_config.get('backend', DEFAULT_BACKEND)
+    if backend not in DETECTORS:
+        raise ValueError(f"Unknown detection backend '{backend}', expected one of {', '.join(DETECTORS)}")
+    template_config = detection_config.get('template') or {}
+    if template_config.get('enabled', False):
+        labels = {field['cropping']['label'] for field in config.get('fields', [])}
+        boxes = set(template_config.get('boxes') or {})
+        missing, unknown = sorted(labels - boxes), sorted(boxes - labels)
+        if missing:
+            raise ValueError(f"detection.template.boxes has no box for the labels {', '.join(missing)}"
+                             + (f" (boxes of unknown labels: {', '.join(unknown)})" if unknown else ""))
+    key = json.dumps(detection_config, sort_keys=True)
+    with _detectors_lock:
+        if key not in _detectors:
+            detector = DETECTORS[backend](detection_config)
+            if template_config.get('enabled', False):
+                detector = TemplateDetector(template_config, detector)
+            _detectors[key] = detector
+        return _detectors[key]
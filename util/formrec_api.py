@@ -4,14 +4,18 @@
 # Import the necessary packages
 from azure.core.credentials import AzureKeyCredential
 from azure.ai.formrecognizer import DocumentAnalysisClient
-from requests.exceptions import ConnectionError
-import azure.ai.vision as sdk
 import os
 import cv2
+import asyncio
 import base64
-import requests
 import json
 import time
+from util import http_client
+from util.cache import get_cached, set_cached
+from util.rate_limit import get_retry_after
+from util.retry import ServiceError, get_retry_policy
+from util.telemetry import span
+from util.timing import timed
 
 # globals
 # FORM_REC_API_VERSION = "2023-07-31" or "2023-02-28-preview"
@@ -19,6 +23,19 @@ VISION_ENDPOINT=os.environ["VISION_ENDPOINT"]
 VISION_KEY = os.environ["VISION_KEY"]
 QR_CODE_MODEL_NAME = "qrcode01"
 CHARGES_MODEL_NAME = "charges01"
+# polling: first wait when the service does not send Retry-After, growth factor and upper bound
+POLL_INITIAL_DELAY = 1.0
+POLL_BACKOFF_FACTOR = 1.5
+POLL_MAX_DELAY = 10.0
+MAX_OPERATIONS_IN_FLIGHT = 16
+# magic bytes of the document types accepted by the analyze endpoint, sent as raw bytes
+CONTENT_TYPES = [
+    (b'%PDF', 'application/pdf'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg')
+]
 
 # -----------------------------
 #   FUNCTIONS
@@ -93,23 +110,69 @@ def get_base64_encoded_file_content(filepath):
         input_bytes = open(filepath, "rb").read()
         return get_base64_encoded_content(input_bytes)
 
+def get_content_type(data):
+    """
+    Returns the content type of a document from its first bytes (PDF, TIFF, PNG or JPEG), application/octet-stream otherwise.
+    """
+    for magic, content_type in CONTENT_TYPES:
+        if data[:len(magic)] == magic:
+            return content_type
+    return "application/octet-stream"
+
+def parse_operation(status, text):
+    """
+    Returns the JSON of an analyze operation poll response.
+
+    Raises:
+    - ServiceError: If the poll failed or the operation failed.
+    """
+    if status != 200:
+        raise ServiceError(f"Analyze result request failed ({status}): {text}", status)
+    result_json = json.loads(text)
+    if result_json["status"] == "failed":
+        raise ServiceError(f"Analyze operation failed: {json.dumps(result_json.get('error'))}", status)
+    return result_json
+
+def next_poll_delay(headers, delay=None):
+    """
+    Returns the seconds to wait before the next poll of an analyze operation: the Retry-After of the last response
+    (the 202 of the analyze request or a poll), otherwise POLL_INITIAL_DELAY for the first poll and the previous
+    delay grown by POLL_BACKOFF_FACTOR, up to POLL_MAX_DELAY, for the next ones.
+    """
+    if delay is None:
+        return get_retry_after(headers, POLL_INITIAL_DELAY)
+    return get_retry_after(headers, min(delay * POLL_BACKOFF_FACTOR, POLL_MAX_DELAY))
+
+def wait_for_poll(budget, delay, operation_id):
+    # the next poll would start after the deadline of the call
+    if delay >= budget.remaining():
+        raise ServiceError(f"Analyze operation {operation_id} not finished within {budget.policy.deadline}s")
+
 def analyze_document_rest(image_data, model, api_version, features=[]):
+    """
+    Analyzes a document with the Document Intelligence REST API and polls the operation until it finishes.
+
+    Failed requests are retried according to the retry policy (see util.retry), with one budget and one deadline
+    for the whole call. The wait between polls honors the service's Retry-After header (see next_poll_delay).
 
-    # Input used to be a file read as bytes before we changed to inmemory approach.
-    # base64EncodedContent = get_base64_encoded_content(image_data)
-    base64EncodedContent = get_base64_encoded_content(image_data)
+    Returns:
+    dict: The analyzeResult of the operation.
 
-    # Request headers
+    Raises:
+    - ServiceError: If the analyze request or the operation failed, or the call did not finish before its deadline.
+    """
+
+    # Same document, model, api version and features: reuse the cached result
+    cache_key, result = get_cached("formrec", image_data, model, api_version, ",".join(sorted(features)))
+    if result is not None:
+        return result
+
+    # Request headers, the document is sent as is in the body (no base64 JSON)
     headers = {
-        "Content-Type": "application/json",
+        "Content-Type": get_content_type(image_data),
         "Ocp-Apim-Subscription-Key": os.environ['FORM_RECOGNIZER_KEY']
     }
 
-    # Request body
-    body = {
-        "base64Source": base64EncodedContent
-    }
-
     # if user wants to get features
     if len(features) > 0:
         features_str = ",".join(features)    
@@ -117,49 +180,146 @@ def analyze_document_rest(image_data, model, api_version, features=[]):
     else:
         request_endpoint = f"{os.environ['FORM_RECOGNIZER_ENDPOINT']}formrecognizer/documentModels/{model}:analyze?api-version={api_version}"
     
-    try:
-        # Send request
-        response = requests.post(request_endpoint, headers=headers, json=body)
-    except requests.exceptions.ConnectionError as e:
-        print("[INFO] Connection error, retrying in 10seconds...")
-        time.sleep(10)
-        response = requests.post(request_endpoint, headers=headers, json=body)
-
-    # Parse response
-    if response.status_code == 202:
+    with span("analyze_document", model=model, bytes=len(image_data)) as operation:
+        # Send request, the POST and the polls share the retries and the deadline of the call
+        budget = get_retry_policy().start()
+        with timed('analyze_post'):
+            response = http_client.post(request_endpoint, endpoint="formrec", budget=budget, headers=headers, data=image_data)
+
+        # Parse response
+        if response.status_code != 202:
+            # Request failed
+            raise ServiceError(f"Analyze request failed ({response.status_code}): {response.text}", response.status_code)
         # Request accepted, get operation ID
         operation_id = response.headers["Operation-Location"].split("/")[-1]
-        # print("Operation ID:", operation_id)
-    else:
+        if operation is not None:
+            operation.set_attribute("operation_id", operation_id)
+
+        # Poll for result
+        result_endpoint = f"{os.environ['FORM_RECOGNIZER_ENDPOINT']}formrecognizer/documentModels/{model}/analyzeResults/{operation_id}"
+        result_headers = {
+            "Content-Type": "application/json-patch+json",
+            "Ocp-Apim-Subscription-Key": headers["Ocp-Apim-Subscription-Key"]
+        }
+
+        polls = 0
+        delay = next_poll_delay(response.headers)
+        with timed('analyze_poll'):
+            while True:
+                wait_for_poll(budget, delay, operation_id)
+                time.sleep(delay)
+                polls += 1
+                with span("analyze_poll", poll=polls) as poll_span:
+                    result_response = http_client.get(result_endpoint, endpoint="formrec_poll", budget=budget, headers=result_headers)
+                    if poll_span is not None:
+                        poll_span.set_attribute("http.status_code", result_response.status_code)
+                result_json = parse_operation(result_response.status_code, result_response.text)
+
+                if result_json["status"] == "succeeded":
+                    result = result_json['analyzeResult']
+                    break
+
+                # Request still processing, wait what the service asks for or back off
+                delay = next_poll_delay(result_response.headers, delay)
+
+    set_cached(cache_key, result)
+    return result
+
+async def analyze_document_async(session, image_data, model, api_version, features=[]):
+    """
+    Asynchronous version of analyze_document_rest.
+
+    Sends the document to the analyze endpoint and polls the operation without blocking the event loop, so many
+    operations can be in flight on a single loop. The wait between polls is the same as for analyze_document_rest
+    (see next_poll_delay).
+
+    Parameters:
+    session (aiohttp.ClientSession): The session used to send the requests.
+    image_data (bytes): The document content.
+    model (str): The Document Intelligence model id.
+    api_version (str): The Document Intelligence API version.
+    features (list of str): Optional add-on features.
+
+    Returns:
+    dict: The analyzeResult of the operation.
+
+    Raises:
+    - ServiceError: If the analyze request or the operation failed, or the call did not finish before its deadline.
+    """
+    # Same document, model, api version and features: reuse the cached result
+    cache_key, result = get_cached("formrec", image_data, model, api_version, ",".join(sorted(features)))
+    if result is not None:
+        return result
+
+    endpoint = os.environ['FORM_RECOGNIZER_ENDPOINT']
+
+    # Request headers, the document is sent as is in the body (no base64 JSON)
+    headers = {
+        "Content-Type": get_content_type(image_data),
+        "Ocp-Apim-Subscription-Key": os.environ['FORM_RECOGNIZER_KEY']
+    }
+
+    request_endpoint = f"{endpoint}formrecognizer/documentModels/{model}:analyze?api-version={api_version}"
+    if len(features) > 0:
+        request_endpoint += f"&features={','.join(features)}"
+
+    # Send request, the POST and the polls share the retries and the deadline of the call
+    budget = get_retry_policy().start()
+    status, response_headers, response_text = await http_client.request_async(session, "POST", request_endpoint, endpoint="formrec", budget=budget, headers=headers, data=image_data)
+    if status != 202:
         # Request failed
-        print("[formrec_api] Error request: ", response.text)
-        exit()
+        raise ServiceError(f"Analyze request failed ({status}): {response_text}", status)
+    operation_id = response_headers["Operation-Location"].split("/")[-1]
+    delay = next_poll_delay(response_headers)
 
     # Poll for result
-    result_endpoint = f"{os.environ['FORM_RECOGNIZER_ENDPOINT']}formrecognizer/documentModels/{model}/analyzeResults/{operation_id}"
-    result_headers = headers.copy()
-    result_headers["Content-Type"] = "application/json-patch+json"
-    result = {}
+    result_endpoint = f"{endpoint}formrecognizer/documentModels/{model}/analyzeResults/{operation_id}"
+    result_headers = {
+        "Content-Type": "application/json-patch+json",
+        "Ocp-Apim-Subscription-Key": headers["Ocp-Apim-Subscription-Key"]
+    }
 
     while True:
-        result_response = requests.get(result_endpoint, headers=result_headers)
-        result_json = json.loads(result_response.text)
-
-        if result_response.status_code != 200 or result_json["status"] == "failed":
-            # Request failed
-            print("Error result: ", result_response.text)
-            break
+        wait_for_poll(budget, delay, operation_id)
+        await asyncio.sleep(delay)
+        status, result_response_headers, result_text = await http_client.request_async(session, "GET", result_endpoint, endpoint="formrec_poll", budget=budget, headers=result_headers)
+        result_json = parse_operation(status, result_text)
 
         if result_json["status"] == "succeeded":
-            # Request succeeded, print result
-            # print("Result:", json.dumps(json.dumps(result_json['analyzeResult']), indent=4))
-            result = result_json['analyzeResult']
-            break
+            set_cached(cache_key, result_json['analyzeResult'])
+            return result_json['analyzeResult']
 
-        # Request still processing, wait and try again
-        time.sleep(2)
+        # Request still processing, wait what the service asks for or back off
+        delay = next_poll_delay(result_response_headers, delay)
 
-    return result
+async def analyze_documents_async(documents, model, api_version, features=[], max_in_flight=MAX_OPERATIONS_IN_FLIGHT):
+    """
+    Analyzes several documents concurrently on the running event loop.
+
+    Parameters:
+    documents (list of bytes): The documents to analyze.
+    model (str): The Document Intelligence model id.
+    api_version (str): The Document Intelligence API version.
+    features (list of str): Optional add-on features.
+    max_in_flight (int): The maximum number of analyze operations submitted and not yet finished.
+
+    Returns:
+    list of dict: The analyzeResult of each document, in the same order as the documents.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async with http_client.create_async_session() as session:
+        async def analyze(document):
+            async with semaphore:
+                return await analyze_document_async(session, document, model, api_version, features)
+        return await asyncio.gather(*[analyze(document) for document in documents])
+
+def analyze_documents_rest(documents, model, api_version, features=[], max_in_flight=MAX_OPERATIONS_IN_FLIGHT):
+    """
+    Blocking entry point for analyze_documents_async: analyzes all the documents on one event loop and returns
+    their results in order.
+    """
+    return asyncio.run(analyze_documents_async(documents, model, api_version, features, max_in_flight))
 
 # some fields have their value (content) split in two or more lines and we need to concatenate them
 def concatenate_lines(selected_line, lines, max_dist=20):
@@ -0,0 +1,195 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import asyncio
+import logging
+import os
+import threading
+import time
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from util.rate_limit import get_limiter, get_retry_after
+from util.retry import RETRYABLE_STATUSES, ServiceError, get_retry_policy
+from util.telemetry import count_retry, observe_request
+
+load_dotenv()
+
+# globals
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 10))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 60))
+# a request throttled (429) more times than this returns its last 429 response
+MAX_THROTTLE_RETRIES = 8
+
+_session = None
+_session_lock = threading.Lock()
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+### Shared client layer for the Vision and Form Recognizer REST calls
+
+def configure(pool_size=None, connect_timeout=None, read_timeout=None):
+    """
+    Overrides the pool size and the per-request timeouts (seconds) read from the environment.
+    The shared session is rebuilt on the next request.
+    """
+    global HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, _session
+    with _session_lock:
+        if pool_size is not None:
+            HTTP_POOL_SIZE = pool_size
+        if connect_timeout is not None:
+            HTTP_CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            HTTP_READ_TIMEOUT = read_timeout
+        if _session is not None:
+            _session.close()
+        _session = None
+
+def get_session():
+    """
+    Returns the process wide requests session.
+
+    The session keeps connections alive between calls, so the analyze request, every poll and every detection
+    request reuse pooled TLS connections instead of opening a new one each time.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def request(method, url, endpoint=None, budget=None, **kwargs):
+    """
+    Sends a request through the shared session, applying the default timeouts when none is given.
+
+    When an endpoint name is given ('vision', 'formrec', 'formrec_poll'), the request goes through the rate limiter
+    of that endpoint (see util.rate_limit) and is sent again after the Retry-After of a 429 response, at most
+    MAX_THROTTLE_RETRIES times. Connection errors, timeouts and retryable statuses (see util.retry) are retried with
+    the budget of the call, a new one from the retry policy when none is given.
+
+    Returns:
+    response (requests.Response): The last response, which may still have a failed status.
+
+    Raises:
+    - ServiceError: If the request could not be sent (connection error or timeout) once its retries ran out.
+    """
+    if endpoint is None:
+        kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        return get_session().request(method, url, **kwargs)
+
+    limiter = get_limiter(endpoint)
+    budget = budget or get_retry_policy().start()
+    throttled = 0
+    while True:
+        kwargs["timeout"] = budget.timeout(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            limiter.release(None)
+            observe_request(endpoint, None, time.perf_counter() - started)
+            delay = budget.next_delay()
+            if delay is None:
+                raise ServiceError(f"{method} {endpoint} failed after {budget.attempt} attempts: {e}") from e
+            logging.warning(f"{method} {endpoint} failed ({e}), retrying in {delay:.1f}s")
+            count_retry(endpoint, 'failed')
+            time.sleep(delay)
+            continue
+        except BaseException:
+            limiter.release(None)
+            raise
+        observe_request(endpoint, response.status_code, time.perf_counter() - started)
+
+        if limiter.release(response.status_code, response.headers):
+            throttled += 1
+            if throttled <= MAX_THROTTLE_RETRIES:
+                count_retry(endpoint, 'throttled')
+                continue
+        elif response.status_code in RETRYABLE_STATUSES:
+            delay = budget.next_delay(get_retry_after(response.headers, None))
+            if delay is not None:
+                logging.warning(f"{method} {endpoint} returned {response.status_code}, retrying in {delay:.1f}s")
+                count_retry(endpoint, 'failed')
+                time.sleep(delay)
+                continue
+        return response
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+async def request_async(session, method, url, endpoint=None, budget=None, **kwargs):
+    """
+    Asynchronous version of request, on an aiohttp session (see create_async_session).
+
+    Returns:
+    status (int): The HTTP status of the response.
+    headers (multidict.CIMultiDictProxy): The response headers.
+    text (str): The response body.
+
+    Raises:
+    - ServiceError: If the request could not be sent (connection error or timeout) once its retries ran out.
+    """
+    limiter = get_limiter(endpoint) if endpoint is not None else None
+    budget = budget or get_retry_policy().start()
+    throttled = 0
+    while True:
+        kwargs["timeout"] = aiohttp.ClientTimeout(total=budget.timeout(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)[1],
+                                                  sock_connect=HTTP_CONNECT_TIMEOUT)
+        if limiter is not None:
+            await limiter.acquire_async()
+        started = time.perf_counter()
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                status, headers, text = response.status, response.headers, await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if limiter is not None:
+                limiter.release(None)
+            observe_request(endpoint, None, time.perf_counter() - started)
+            delay = budget.next_delay()
+            if delay is None:
+                raise ServiceError(f"{method} {endpoint} failed after {budget.attempt} attempts: {e!r}") from e
+            logging.warning(f"{method} {endpoint} failed ({e!r}), retrying in {delay:.1f}s")
+            count_retry(endpoint, 'failed')
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            if limiter is not None:
+                limiter.release(None)
+            raise
+        observe_request(endpoint, status, time.perf_counter() - started)
+
+        if limiter is not None and limiter.release(status, headers):
+            throttled += 1
+            if throttled <= MAX_THROTTLE_RETRIES:
+                count_retry(endpoint, 'throttled')
+                continue
+        elif status in RETRYABLE_STATUSES:
+            delay = budget.next_delay(get_retry_after(headers, None))
+            if delay is not None:
+                logging.warning(f"{method} {endpoint} returned {status}, retrying in {delay:.1f}s")
+                count_retry(endpoint, 'failed')
+                await asyncio.sleep(delay)
+                continue
+        return status, headers, text
+
+def create_async_session():
+    """
+    Creates an aiohttp session with the same pool size and timeouts as the shared requests session.
+    aiohttp sessions are bound to an event loop, so each loop creates (and closes) its own.
+    """
+    connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE)
+    timeout = aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
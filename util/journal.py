@@ -0,0 +1,92 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# globals
+DEFAULT_JOURNAL_FILE = 'work/journal.sqlite'
+
+# processing stages, in order
+STAGE_RASTERIZED = 'rasterized'
+STAGE_DETECTED = 'detected'
+STAGE_ANALYZED = 'analyzed'
+STAGE_POSTPROCESSED = 'postprocessed'
+
+# -----------------------------
+#   CLASSES
+# -----------------------------
+
+class JobJournal:
+    """
+    Persistent record of the stage reached by each form of a run, with the intermediate results.
+
+    The journal is a SQLite database with one row per (file, page, config) holding the last completed stage, the
+    object detection result, the per-field analysis (words, cropping confidence) and the final record. A restarted
+    run reads it to continue each form from its last completed stage instead of calling the services again.
+    Entries are keyed by a digest of the config, so changing the config starts the forms from scratch.
+    """
+
+    def __init__(self, journal_file, config):
+        journal_dir = os.path.dirname(journal_file)
+        if journal_dir and not os.path.exists(journal_dir): os.makedirs(journal_dir)
+        self.journal_file = journal_file
+        self.config_digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(journal_file, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " file TEXT NOT NULL,"
+                " page INTEGER NOT NULL,"
+                " config TEXT NOT NULL,"
+                " stage TEXT NOT NULL,"
+                " detection TEXT,"
+                " analysis TEXT,"
+                " record TEXT,"
+                " updated REAL NOT NULL,"
+                " PRIMARY KEY (file, page, config))")
+
+    def get(self, form_file, page_index=0):
+        """
+        Returns the journal entry of a form (a page of a file): a dict with 'stage', 'detection', 'analysis' and 'record' (None when
+        the stage was not reached), or None when the form is not in the journal.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT stage, detection, analysis, record FROM pages WHERE file = ? AND page = ? AND config = ?",
+                (os.path.abspath(form_file), page_index, self.config_digest)).fetchone()
+        if row is None:
+            return None
+        stage, detection, analysis, record = row
+        return {
+            'stage': stage,
+            'detection': json.loads(detection) if detection else None,
+            'analysis': json.loads(analysis) if analysis else None,
+            'record': json.loads(record) if record else None
+        }
+
+    def update(self, form_file, page_index, stage, **results):
+        """
+        Records that a form completed a stage, storing the given results ('detection', 'analysis' or 'record').
+        Results stored by earlier stages are kept.
+        """
+        columns = {name: json.dumps(value) for name, value in results.items() if name in ('detection', 'analysis', 'record')}
+        assignments = ''.join(f", {name} = excluded.{name}" for name in columns)
+        names = ''.join(f", {name}" for name in columns)
+        placeholders = ''.join(", ?" for _ in columns)
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"INSERT INTO pages (file, page, config, stage, updated{names}) VALUES (?, ?, ?, ?, ?{placeholders}) "
+                f"ON CONFLICT (file, page, config) DO UPDATE SET stage = excluded.stage, updated = excluded.updated{assignments}",
+                (os.path.abspath(form_file), page_index, self.config_digest, stage, time.time(), *columns.values()))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
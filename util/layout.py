@@ -0,0 +1,148 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+from typing import NamedTuple
+import numpy as np
+from util.payload import PAYLOAD_DPI, normalize_page_units
+
+# globals
+DEFAULT_LAYOUT = 'page'
+LAYOUTS = ('page', 'mosaic')
+# mosaic pages are letter size at the payload resolution
+MOSAIC_PAGE_WIDTH = 1700
+MOSAIC_PAGE_HEIGHT = 2200
+# white space between crops, wide enough for the service not to merge words of neighbouring crops
+MOSAIC_GAP = 80
+
+# -----------------------------
+#   CLASSES
+# -----------------------------
+
+class Slot(NamedTuple):
+    """
+    The place of a crop in the analysis document: its page (one-based) and its pixel rectangle on the page.
+    """
+    page_number: int
+    left: int
+    top: int
+    width: int
+    height: int
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def page_layout(images):
+    """
+    One page per crop (the default layout).
+
+    Returns:
+    pages (list of numpy.ndarray): The pages of the document, the crops themselves.
+    slots (list of Slot): The slot of each crop, in the same order as the images.
+    """
+    slots = [Slot(i+1, 0, 0, image.shape[1], image.shape[0]) for i, image in enumerate(images)]
+    return images, slots
+
+def mosaic_layout(images, page_width=MOSAIC_PAGE_WIDTH, page_height=MOSAIC_PAGE_HEIGHT, gap=MOSAIC_GAP):
+    """
+    Packs the crops on as few pages as possible, in shelves of crops placed left to right, tallest crops first.
+
+    Crops are separated by gap white pixels. The last page is cut to the height of its content. A crop larger than
+    the page gets a page of its size.
+
+    Returns:
+    pages (list of numpy.ndarray): The grayscale pages of the document.
+    slots (list of Slot): The slot of each crop, in the same order as the images.
+    """
+    page_width = max([page_width] + [image.shape[1] for image in images])
+    slots = [None] * len(images)
+    page_number = 0
+    page_bottom = page_height
+    x = shelf_top = shelf_height = 0
+    for i in sorted(range(len(images)), key=lambda i: -images[i].shape[0]):
+        height, width = images[i].shape[:2]
+        if x > 0 and x + width > page_width:
+            # next shelf
+            shelf_top += shelf_height + gap
+            x = shelf_height = 0
+        if page_number == 0 or (shelf_top > 0 and shelf_top + height > page_bottom):
+            # next page
+            page_number += 1
+            page_bottom = max(page_height, height)
+            x = shelf_top = shelf_height = 0
+        slots[i] = Slot(page_number, x, shelf_top, width, height)
+        x += width + gap
+        shelf_height = max(shelf_height, height)
+
+    pages = []
+    for number in range(1, page_number+1):
+        page_slots = [(slot, images[i]) for i, slot in enumerate(slots) if slot.page_number == number]
+        height = max(slot.top + slot.height for slot, _ in page_slots)
+        if number < page_number:
+            height = max(height, page_height)
+        page = np.full((height, page_width), 255, np.uint8)
+        for slot, image in page_slots:
+            page[slot.top:slot.top+slot.height, slot.left:slot.left+slot.width] = image
+        pages.append(page)
+    return pages, slots
+
+def get_layout(layout=DEFAULT_LAYOUT):
+    """
+    Returns the function that places the crops of an analysis request on pages: page_layout or mosaic_layout.
+
+    Raises:
+    - ValueError: If the layout is unknown.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}', expected one of {', '.join(LAYOUTS)}")
+    return mosaic_layout if layout == 'mosaic' else page_layout
+
+def index_pages(analyze_result):
+    """
+    Indexes the pages of a document analysis result by page number.
+    """
+    return {page['pageNumber']: page for page in analyze_result['pages']}
+
+def slot_distance(slot, x, y):
+    # distance from a point to the rectangle of a slot, 0 inside
+    dx = max(slot.left - x, 0, x - (slot.left + slot.width))
+    dy = max(slot.top - y, 0, y - (slot.top + slot.height))
+    return dx*dx + dy*dy
+
+def split_words(analyze_result, slots, dpi=PAYLOAD_DPI):
+    """
+    Maps the words of an analysis result back to the crops they were read from.
+
+    Word polygons are converted to inches relative to the top left corner of their crop, so they are the same as when
+    the crop is alone on its page. A word belongs to the slot that contains the center of its polygon (the nearest
+    slot when the center falls in a gap). When a page holds a single crop, all its words are that crop's words.
+
+    Returns:
+    list: For each slot, the list of its words, or None when its page is missing from the result.
+    """
+    pages = index_pages(analyze_result)
+    words = [None] * len(slots)
+    slots_by_page = {}
+    for i, slot in enumerate(slots):
+        slots_by_page.setdefault(slot.page_number, []).append(i)
+
+    for page_number, indices in slots_by_page.items():
+        page = pages.get(page_number)
+        if page is None:
+            continue
+        page = normalize_page_units(page, dpi)
+        if len(indices) == 1 and slots[indices[0]].left == 0 and slots[indices[0]].top == 0:
+            words[indices[0]] = page['words']
+            continue
+        for i in indices:
+            words[i] = []
+        for word in page['words']:
+            polygon = word['polygon']
+            # word center, in pixels
+            x = sum(polygon[0::2]) / (len(polygon) // 2) * dpi
+            y = sum(polygon[1::2]) / (len(polygon) // 2) * dpi
+            i = min(indices, key=lambda i: slot_distance(slots[i], x, y))
+            left, top = slots[i].left / dpi, slots[i].top / dpi
+            words[i].append({**word, 'polygon': [value - (left if j % 2 == 0 else top) for j, value in enumerate(polygon)]})
+    return words
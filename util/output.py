@@ -0,0 +1,158 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import csv
+import logging
+import os
+
+# globals
+DEFAULT_FLUSH_EVERY = 50
+WRITE_BUFFER_SIZE = 1024*1024
+
+# -----------------------------
+#   CLASSES
+# -----------------------------
+
+class CsvSink:
+    """
+    Streams records to a CSV file that stays open for the whole run.
+
+    Rows go through a write buffer and are flushed (and fsync'ed) every flush_every rows and on close, so a crash
+    loses at most the last flush_every rows. When the file already exists the rows are appended to it, after
+    removing the incomplete row a crash may have left at its end (see drop_partial_row), otherwise it is created with
+    the header.
+    """
+
+    def __init__(self, output_file, header, flush_every=DEFAULT_FLUSH_EVERY, fsync=True):
+        self.output_file = output_file
+        self.flush_every = flush_every
+        self.fsync = fsync
+        self.pending = 0
+        exists = os.path.exists(output_file) and os.path.getsize(output_file) > 0
+        if exists:
+            existing_header = read_header(output_file)
+            if existing_header != header:
+                raise ValueError(f"Cannot append to {output_file}: its columns do not match the config ({existing_header} != {header})")
+            if drop_partial_row(output_file):
+                logging.warning(f"Repaired the incomplete last row of {output_file}")
+        self.file = open(output_file, "a" if exists else "w", newline="", buffering=WRITE_BUFFER_SIZE)
+        self.writer = csv.DictWriter(self.file, fieldnames=header)
+        if not exists:
+            self.writer.writeheader()
+            self.flush()
+
+    def write(self, record):
+        self.writer.writerow(record)
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def read_header(output_file):
+    with open(output_file, newline="") as f:
+        return next(csv.reader(f), [])
+
+def is_complete(row):
+    # rows cut short have None values (missing columns), rows glued to a cut one have extra values (None key)
+    return None not in row and None not in row.values()
+
+def drop_partial_row(output_file):
+    """
+    Makes an output CSV end with a complete row. A run killed while its write buffer was being written can leave half
+    a row at the end of the file, and the rows of the next run would be appended to it: a last row with missing
+    columns is removed, a last row with all its columns but no line end gets one (read_processed counts it).
+
+    Returns:
+    bool: True when the file was changed.
+    """
+    with open(output_file, "rb") as f:
+        data = f.read()
+
+    # the reader pulls one line at a time (a quoted value can span several), ends has the offset after each line
+    ends = [0]
+    def lines():
+        while ends[-1] < len(data):
+            end = data.find(b"\n", ends[-1])
+            end = len(data) if end < 0 else end + 1
+            line = data[ends[-1]:end]
+            ends.append(end)
+            yield line.decode("utf-8", errors="replace")
+
+    reader = csv.reader(lines())
+    header = next(reader, [])
+    last_start, row_start, complete = None, ends[-1], True
+    for row in reader:
+        last_start, row_start = row_start, ends[-1]
+        complete = len(row) == len(header)
+    if data.endswith(b"\n") and complete:
+        return False
+    with open(output_file, "r+b") as f:
+        if complete:
+            f.seek(0, os.SEEK_END)
+            f.write(b"\n" if data.endswith(b"\r") else b"\r\n")
+        else:
+            f.truncate(last_start)
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+def drop_failed(output_file, column='error'):
+    """
+    Removes the rows of failed forms (a non-empty error column) and incomplete rows from an output CSV, so a resumed
+    run processes them again. The file is rewritten only when it has such rows.
+
+    Returns:
+    int: The number of rows removed.
+    """
+    if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        return 0
+    with open(output_file, newline="") as f:
+        reader = csv.DictReader(f)
+        if column not in (reader.fieldnames or []):
+            return 0
+        header = reader.fieldnames
+        rows = list(reader)
+    kept = [row for row in rows if is_complete(row) and not row[column]]
+    if len(kept) == len(rows):
+        return 0
+    temp_file = output_file + ".tmp"
+    with open(temp_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=header)
+        writer.writeheader()
+        writer.writerows(kept)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, output_file)
+    return len(rows) - len(kept)
+
+def read_processed(output_file, key=('fileName', 'pageNumber')):
+    """
+    Returns the values of the key columns already written to an output CSV, as tuples of strings (empty when the
+    file does not exist). Incomplete rows are skipped, their pages are processed again.
+    """
+    if not os.path.exists(output_file):
+        return set()
+    with open(output_file, newline="") as f:
+        return {tuple(row[column] for column in key) for row in csv.DictReader(f)
+                if is_complete(row) and all(row.get(column) for column in key)}
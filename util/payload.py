@@ -0,0 +1,104 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import importlib.util
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+from PIL import Image
+
+# globals
+DEFAULT_PAYLOAD_FORMAT = 'pdf'
+# resolution of the crop pages, also used to convert pixel coordinates of image results to inches
+PAYLOAD_DPI = 200
+# gray level above which a pixel is white in 1-bit pages
+BINARY_THRESHOLD = 128
+# creation and modification date written in the PDFs, fixed so the same crops always give the same bytes (and the
+# same result cache key) instead of a new timestamp on every run
+PDF_DATE = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def to_binary(image):
+    # plain threshold, the default conversion to mode '1' dithers
+    return Image.fromarray(image).point(lambda value: 255 if value >= BINARY_THRESHOLD else 0, mode='1')
+
+def encode_pdf(images):
+    pages = [Image.fromarray(image) for image in images]
+    buffer = BytesIO()
+    date = time.gmtime(PDF_DATE.timestamp())
+    pages[0].save(buffer, "PDF", save_all=True, append_images=pages[1:], resolution=PAYLOAD_DPI, optimize=True, quality=100,
+                  creationDate=date, modDate=date)
+    return buffer.getvalue()
+
+def encode_tiff_g4(images):
+    pages = [to_binary(image) for image in images]
+    buffer = BytesIO()
+    pages[0].save(buffer, "TIFF", save_all=True, append_images=pages[1:], compression="group4", dpi=(PAYLOAD_DPI, PAYLOAD_DPI))
+    return buffer.getvalue()
+
+def encode_tiff_lzw(images):
+    pages = [Image.fromarray(image) for image in images]
+    buffer = BytesIO()
+    pages[0].save(buffer, "TIFF", save_all=True, append_images=pages[1:], compression="tiff_lzw", dpi=(PAYLOAD_DPI, PAYLOAD_DPI))
+    return buffer.getvalue()
+
+def encode_pdf_g4(images):
+    import img2pdf
+
+    # img2pdf embeds single page G4 TIFFs in the PDF as they are, without re-encoding them
+    pages = []
+    for image in images:
+        buffer = BytesIO()
+        to_binary(image).save(buffer, "TIFF", compression="group4", dpi=(PAYLOAD_DPI, PAYLOAD_DPI))
+        pages.append(buffer.getvalue())
+    return img2pdf.convert(pages, creationdate=PDF_DATE, moddate=PDF_DATE)
+
+PAYLOAD_ENCODERS = {
+    'pdf': encode_pdf,
+    'tiff-g4': encode_tiff_g4,
+    'tiff-lzw': encode_tiff_lzw,
+    'pdf-g4': encode_pdf_g4
+}
+
+def get_payload_encoder(payload_format=DEFAULT_PAYLOAD_FORMAT):
+    """
+    Returns the function that packs the field crops of a document analysis request into one multi-page document.
+
+    Formats:
+    - pdf: PIL PDF of the grayscale crops (the default).
+    - tiff-g4: 1-bit multi-page TIFF with CCITT group 4 compression. The crops are thresholded, which loses nothing
+      for denoised fields (their background is already white) and is usually much smaller.
+    - tiff-lzw: grayscale multi-page TIFF with LZW compression, lossless.
+    - pdf-g4: PDF with 1-bit group 4 pages, requires img2pdf.
+
+    Encoders take the crops (grayscale numpy arrays, one page each) and return the document bytes, the same bytes for
+    the same crops.
+
+    Raises:
+    - ValueError: If the format is unknown or its optional dependency is not installed.
+    """
+    if payload_format not in PAYLOAD_ENCODERS:
+        raise ValueError(f"Unknown payload format '{payload_format}', expected one of {', '.join(PAYLOAD_ENCODERS)}")
+    if payload_format == 'pdf-g4' and importlib.util.find_spec('img2pdf') is None:
+        raise ValueError("The pdf-g4 payload format requires img2pdf (pip install img2pdf)")
+    return PAYLOAD_ENCODERS[payload_format]
+
+def normalize_page_units(page, dpi=PAYLOAD_DPI):
+    """
+    Returns the page of an analysis result with its word polygons in inches.
+
+    PDF pages are measured in inches, image pages (TIFF) in pixels. Post-processing thresholds are in inches, so
+    pixel coordinates are divided by the resolution the pages were encoded at.
+    """
+    if page.get('unit') != 'pixel':
+        return page
+    words = [{**word, 'polygon': [value / dpi for value in word['polygon']]} for word in page['words']]
+    normalized = {**page, 'unit': 'inch', 'words': words}
+    for dimension in ('width', 'height'):
+        if dimension in page:
+            normalized[dimension] = page[dimension] / dpi
+    return normalized
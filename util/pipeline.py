@@ -0,0 +1,150 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import importlib
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+from util.detection import get_detector
+from util.layout import DEFAULT_LAYOUT, get_layout
+from util.payload import DEFAULT_PAYLOAD_FORMAT, get_payload_encoder
+from util.telemetry import span
+from util.timing import StageTimes
+
+# globals
+POSTPROCESSING_PACKAGE = 'modules'
+
+# -----------------------------
+#   CLASSES
+# -----------------------------
+
+class FieldSpec(NamedTuple):
+    """
+    The read-only config of a field. cropping is a read-only view of the cropping parameters.
+    """
+    name: str
+    cardinality: int
+    remove_noise: bool
+    cropping: Mapping
+    module: str
+
+    def __reduce__(self):
+        # mapping proxies cannot be pickled, worker processes get a copy of the cropping parameters
+        return field_spec, (self.name, self.cardinality, self.remove_noise, dict(self.cropping), self.module)
+
+class FieldState:
+    """
+    The state of a field of one form: cropping results, crop image, page in the analysis request and analyzed words.
+    """
+    __slots__ = ('confidence', 'found', 'roi', 'page_number', 'words', 'filename')
+
+    def __init__(self, confidence=-1.0, found=False, words=None):
+        self.confidence = confidence
+        self.found = found
+        self.roi = None
+        self.page_number = None
+        self.words = words
+        self.filename = None
+
+class FormContext:
+    """
+    The state of one form (a page of a file) while it goes through the pipeline.
+
+    stage is the last completed stage (None for a new form), record the initialized record (or the final one for
+    post-processed forms), detection the object detection result, fields one FieldState per configured field and error
+    the message of the service call that failed for the form (None while it has not failed) and timings the seconds
+    it spent in each stage (see util.timing).
+    """
+    __slots__ = ('file', 'page', 'stage', 'record', 'detection', 'fields', 'error', 'timings')
+
+    def __init__(self, file, page, record, fields):
+        self.file = file
+        self.page = page
+        self.stage = None
+        self.record = record
+        self.detection = None
+        self.fields = fields
+        self.error = None
+        self.timings = StageTimes()
+
+class Pipeline:
+    """
+    The processing steps of a form config, resolved once before any form is processed.
+
+    Compiling the config loads the detector, selects the page layout and payload encoder, imports the post-processing module of every field and turns the fields
+    into read-only FieldSpecs, so a wrong module name or detection backend fails at startup instead of after the first
+    service calls. The pipeline is shared by all the batches of a run and never changes: the state of each form is
+    held in its own FormContext.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.fields = tuple(field_spec(field['name'], field['cardinality'], field.get('remove_noise', False), field['cropping'],
+                                       (field.get('postprocessing') or {}).get('module'))
+                            for field in config['fields'])
+        self.header = ['fileName', 'pageNumber']
+        for field in self.fields:
+            for i in range(1, field.cardinality+1):
+                self.header.append(f"{field.name}_{i}")
+        # why the form could not be processed, empty for processed forms
+        self.header.append('error')
+        self.detector = get_detector(config)
+        self.payload_format = config['document_analysis'].get('payload_format', DEFAULT_PAYLOAD_FORMAT)
+        self.encode_payload = get_payload_encoder(self.payload_format)
+        self.layout = config['document_analysis'].get('layout', DEFAULT_LAYOUT)
+        self.place_crops = get_layout(self.layout)
+        self.modules = tuple(load_postprocessing_module(field) for field in self.fields)
+
+    def new_form(self, file, page_index=0):
+        record = dict.fromkeys(self.header, '')
+        record['fileName'] = file.split('/')[-1]
+        record['pageNumber'] = page_index+1
+        return FormContext(file, page_index, record, [FieldState() for _ in self.fields])
+
+    def postprocess(self, record, states):
+        """
+        Runs the post-processing module of each analyzed field and merges its values into the record.
+
+        Modules get the field as a dict with its 'name', 'cropping' ('confidence' and 'found') and 'analysis' ('words').
+
+        Parameters:
+        record (dict): The initialized record of the form.
+        states (list of FieldState): The fields of the form, in config order; fields without words are skipped.
+
+        Returns:
+        record (dict): A new record with the extracted field values.
+        """
+        for field, state, module in zip(self.fields, states, self.modules):
+            if state.words is not None:
+                field_input = {
+                    'name': field.name,
+                    'cropping': {'confidence': state.confidence, 'found': state.found},
+                    'analysis': {'words': state.words}
+                }
+                with span("postprocess", field=field.name, module=field.module):
+                    record = {**record, **module.run(field_input)}
+        return record
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def field_spec(name, cardinality, remove_noise, cropping, module):
+    return FieldSpec(name, cardinality, remove_noise, MappingProxyType(dict(cropping)), module)
+
+def load_postprocessing_module(field):
+    """
+    Imports the post-processing module of a field (postprocessing.module, relative to the modules package).
+
+    Raises:
+    - ValueError: If the field has no post-processing module, the module cannot be imported or it has no run function.
+    """
+    if not field.module:
+        raise ValueError(f"Field '{field.name}' has no postprocessing.module")
+    try:
+        module = importlib.import_module(f"{POSTPROCESSING_PACKAGE}.{field.module}")
+    except ImportError as e:
+        raise ValueError(f"Cannot import post-processing module '{field.module}' of field '{field.name}': {e}") from e
+    if not callable(getattr(module, 'run', None)):
+        raise ValueError(f"Post-processing module '{field.module}' of field '{field.name}' has no run(field) function")
+    return module
@@ -3,6 +3,48 @@ import string
 from datetime import datetime, timedelta
 from util.general import count_digits
 
+class WordLines:
+    """
+    The words of a field grouped in lines, computed once per field.
+
+    words is the reading order of sort_words: words sorted by top, grouped in rows (a word joins a row when its top
+    is within line_threshold of the first word of the row) and each row sorted left to right.
+
+    Lines are counted the way count_words_in_line counts them on the sorted words: a new line starts when a word's
+    top is more than line_threshold away from the first word of the current line. line_counts holds the number of
+    words of each line.
+    """
+
+    def __init__(self, words, line_threshold):
+        rows = []
+        row = []
+        for word in sorted(words, key=lambda word: word['polygon'][1]):
+            if len(row) > 0 and abs(word['polygon'][1] - row[0]['polygon'][1]) >= line_threshold:
+                rows.append(row)
+                row = []
+            row.append(word)
+        if len(row) > 0:
+            rows.append(row)
+        self.words = [word for row in rows for word in sorted(row, key=lambda word: word['polygon'][0])]
+
+        self.line_counts = []
+        line_top = None
+        for word in self.words:
+            top = word['polygon'][1]
+            if line_top is None or abs(top - line_top) > line_threshold:
+                self.line_counts.append(0)
+                line_top = top
+            self.line_counts[-1] += 1
+
+    def count_words_in_line(self, line_number):
+        """
+        Returns the number of words of a line (one-based), 0 when there is no such line.
+        """
+        if 1 <= line_number <= len(self.line_counts):
+            return self.line_counts[line_number-1]
+        return 0
+
+
 def remove_non_alphanumeric(text):
     pattern = r'[^a-zA-Z0-9\s]+'
     return re.sub(pattern, '', text)
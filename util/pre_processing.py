@@ -7,6 +7,9 @@ import numpy as np
 import imutils
 from util.general import load_image
 
+# globals
+HLINE_KERNEL = np.ones((3, 40), np.uint8)
+
 # -----------------------------
 #   FUNCTIONS
 # -----------------------------
@@ -40,8 +43,8 @@ def remove_blobs(img, area_threshold):
     The function works as follows:
     - It first converts the input image to binary.
     - It then finds all connected components (blobs) in the binary image.
-    - It removes all blobs that have an area less than the specified area_threshold.
-    - It creates a new binary image with only the large blobs.
+    - It builds a lookup table indexed by label that keeps only the blobs with an area of at least area_threshold.
+    - It creates a new binary image with only the large blobs in a single pass over the labels.
     - It converts the binary image back to grayscale.
     - Finally, it inverts the image and returns it.
     """    
@@ -49,13 +52,11 @@ def remove_blobs(img, area_threshold):
     _, binary = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
     # Find connected components
     num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=4)
-    # remove small blobs
-    for i in range(1, num_labels):
-        if stats[i, cv2.CC_STAT_AREA] < area_threshold:
-            labels[labels == i] = 0
+    # keep-mask indexed by label: 255 for large blobs, 0 for small blobs and the background (label 0)
+    keep = np.where(stats[:, cv2.CC_STAT_AREA] >= area_threshold, 255, 0).astype(np.uint8)
+    keep[0] = 0
     # create new image with only large blobs
-    new_binary = np.zeros_like(binary)
-    new_binary[labels > 0] = 255
+    new_binary = keep.take(labels)
     # convert binary image to grayscale
     new_img = cv2.cvtColor(new_binary, cv2.COLOR_GRAY2BGR)
     # invert image
@@ -89,69 +90,138 @@ def remove_hlines(image):
     gray[binary > 0] = 255
     return gray
 
-def crop(input_image, cv_result, config):
+def keep_large_blobs(binary, area_threshold, out):
     """
-    This function crops an image based on the highest confidence area detected by a custom model.
+    Writes to out the grayscale image of the blobs of binary with an area of at least area_threshold: black blobs on a
+    white background, the same values remove_blobs returns, without the BGR round trip.
+    """
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity=4)
+    # inverted keep-mask indexed by label: 0 (black) for large blobs, 255 for small blobs and the background
+    keep = np.where(stats[:, cv2.CC_STAT_AREA] >= area_threshold, 0, 255).astype(np.uint8)
+    keep[0] = 255
+    np.take(keep, labels, out=out)
+    return out
+
+def remove_hlines_inplace(gray, binary, scratch):
+    """
+    Same as remove_hlines on a grayscale image, modifying it in place and using binary and scratch as work buffers.
+    """
+    cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 15, 2, dst=binary)
+    cv2.morphologyEx(binary, cv2.MORPH_OPEN, HLINE_KERNEL, dst=scratch)
+    # the mask is 0/255, so the max sets the line pixels to white and keeps the rest
+    cv2.max(gray, scratch, dst=gray)
+    return gray
+
+def denoise(gray, large_blob_area=40, small_blob_area=10):
+    """
+    Fused version of remove_blobs(40) -> remove_hlines -> remove_blobs(10) -> remove_hlines.
+
+    Parameters:
+    gray (numpy.ndarray): The grayscale crop.
+    large_blob_area (int): The area threshold of the first blob removal.
+    small_blob_area (int): The area threshold of the second blob removal.
+
+    Returns:
+    out (numpy.ndarray): The denoised grayscale crop, black text on a white background.
+
+    The whole chain runs on one grayscale output buffer and two scratch buffers, with no gray/BGR conversions.
+    After the first pass the image only holds 0 and 255, so the second binarization is a fixed threshold instead of
+    Otsu (for a two-level image both give the same mask).
+    """
+    binary = np.empty_like(gray)
+    scratch = np.empty_like(gray)
+    out = np.empty_like(gray)
+
+    cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU, dst=binary)
+    keep_large_blobs(binary, large_blob_area, out)
+    remove_hlines_inplace(out, binary, scratch)
+
+    cv2.threshold(out, 127, 255, cv2.THRESH_BINARY_INV, dst=binary)
+    keep_large_blobs(binary, small_blob_area, out)
+    remove_hlines_inplace(out, binary, scratch)
+
+    return out
+
+def index_detections(cv_result):
+    """
+    Indexes the custom model result by label.
 
     Parameters:
-        input_image (numpy.ndarray): The input image to be cropped.
         cv_result (dict): The result from the custom model, which includes detected objects and their confidence scores.
+
+    Returns:
+        detections (dict): For each label, a (object, confidence) tuple with the highest confidence detection of that label.
+    """
+    detections = {}
+    for obj in cv_result['customModelResult']['objectsResult']['values']:
+        for tag in obj['tags']:
+            if tag['confidence'] > detections.get(tag['name'], (None, 0.0))[1]:
+                detections[tag['name']] = (obj, tag['confidence'])
+    return detections
+
+def crop_box(detections, config, image_shape):
+    """
+    Computes the region of the page to crop for a field.
+
+    Parameters:
+        detections (dict): The detections indexed by label (see index_detections).
         config (dict): A configuration dictionary that includes parameters for cropping and object detection.
+        image_shape (tuple): The shape of the page image.
 
     Returns:
-        cropped (numpy.ndarray): The cropped image.
-        confidence (float): The confidence score of the detected area that the image was cropped to.
+        box (tuple): The (top, bottom, left, right) pixel bounds of the region, clipped to the image the way numpy slicing
+                     clips them, or None when no suitable area was found.
+        confidence (float): The confidence score of the detected area.
         found (bool): A boolean indicating whether a suitable area for cropping was found.
-
-    Raises:
-        Exception: If there is an error during the cropping operation.
     """
+    obj, confidence = detections.get(config['label'], (None, 0.0))
+    if obj is None or confidence < config["detection_threshold"]:
+        return None, -1.0, False
 
     # cropping parameters
-    roi_max_height = config['max_height']
-    roi_max_width = config['max_width']
     border = config["border"] # pixels
-    height_multiplier = config["height_multiplier"]
-    width_multiplier = config["width_multiplier"]    
-    detection_threshold = config["detection_threshold"]
     x_offset = config["x_offset"]
     y_offset = config["y_offset"]    
 
-    # initialize the cropped images
-    cropped = np.zeros((roi_max_width,roi_max_width,3),np.uint8)
-    confidence = -1.0
-    found = False
-    
-    # get highest confidence area
-    object = {}
-    highest_confidence = 0.0
-    for obj in cv_result['customModelResult']['objectsResult']['values']:
-        for tag in obj['tags']:
-            if tag['confidence'] > highest_confidence and tag['name'] == config['label']:
-                highest_confidence = tag['confidence']
-                object = obj
+    x = obj['boundingBox']['x'] + x_offset
+    y = obj['boundingBox']['y'] + y_offset
+    w = obj['boundingBox']['w']
+    h = obj['boundingBox']['h']
+    roi_height = min(int(config["height_multiplier"]*h), config['max_height'])
+    roi_width = min(int(config["width_multiplier"]*w), config['max_width'])
 
-   # check if object was found
-    if object != {}:
-        for tag in object['tags']:
-            if tag['confidence'] >= detection_threshold and tag['name'] == config['label']:
-                confidence = tag['confidence']
-                found = True
-                # image = cv2.imread(input_image)
-                image = input_image                
+    top, bottom, _ = slice(y+h+y_offset, y+h+y_offset+roi_height).indices(image_shape[0])
+    left, right, _ = slice(x+border, x+roi_width-border-x_offset).indices(image_shape[1])
+    return (top, max(bottom, top), left, max(right, left)), confidence, True
 
-                x = object['boundingBox']['x'] + x_offset
-                y = object['boundingBox']['y'] + y_offset
-                w = object['boundingBox']['w']
-                h = object['boundingBox']['h']
-                roi_height = int(height_multiplier*h)
-                roi_height = min(roi_height, roi_max_height)
-                roi_width = int(width_multiplier*w)
-                roi_width = min(roi_width , roi_max_width)
+def crop(input_image, cv_result, config, detections=None):
+    """
+    This function crops an image based on the highest confidence area detected by a custom model.
+
+    Parameters:
+        input_image (numpy.ndarray): The input image to be cropped.
+        cv_result (dict): The result from the custom model, which includes detected objects and their confidence scores.
+        config (dict): A configuration dictionary that includes parameters for cropping and object detection.
+        detections (dict): Optional index of cv_result by label (see index_detections), to avoid scanning the result for every field.
+
+    Returns:
+        cropped (numpy.ndarray): The cropped image.
+        confidence (float): The confidence score of the detected area that the image was cropped to.
+        found (bool): A boolean indicating whether a suitable area for cropping was found.
+
+    Raises:
+        Exception: If there is an error during the cropping operation.
+    """
+    if detections is None:
+        detections = index_detections(cv_result)
 
-                cropped = image[y+h+y_offset:y+h+y_offset+roi_height, x+border:x+roi_width-border-x_offset]
+    box, confidence, found = crop_box(detections, config, input_image.shape)
+    if not found:
+        roi_max_width = config['max_width']
+        return np.zeros((roi_max_width,roi_max_width,3),np.uint8), confidence, found
 
-    return cropped, confidence, found
+    top, bottom, left, right = box
+    return input_image[top:bottom, left:right], confidence, found
 
 def crop_qty(input_image, cv_result):
 
@@ -0,0 +1,87 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import logging
+import os
+import threading
+import imutils
+import numpy as np
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+    logging.warning("pypdfium2 is not installed, rasterization falls back to pdf2image (poppler)")
+
+# globals
+FALLBACK_DPI = 200
+
+# pdfium is not thread safe, renders in the same process are serialized
+_pdfium_lock = threading.Lock()
+
+def _reset_pdfium_lock():
+    # a worker process forked while another thread held the lock (counting pages) would otherwise never get it
+    global _pdfium_lock
+    _pdfium_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pdfium_lock)
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def count_pages(pdf_path):
+    """
+    Returns the number of pages of a PDF file, without rendering any of them.
+    """
+    if pdfium is not None:
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_path)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+    return pdfinfo_from_path(pdf_path)['Pages']
+
+def render_page(pdf_path, width, page_index=0, grayscale=False):
+    """
+    Renders a PDF page straight to the requested width, directly into a numpy array.
+
+    With pypdfium2 the page is rendered in-process at the scale that gives the target width, so there is no
+    poppler subprocess, no temporary image and no resize afterwards. Without it, pdf2image is asked for the target
+    size directly.
+
+    Parameters:
+    pdf_path (str): The path to the PDF file.
+    width (int): The width of the rendered page, in pixels.
+    page_index (int): The zero-based index of the page to render.
+    grayscale (bool): Render a single channel grayscale image instead of RGB.
+
+    Returns:
+    image (numpy.ndarray): The page image, (height, width) when grayscale, (height, width, 3) RGB otherwise.
+    """
+    if pdfium is not None:
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_path)
+            try:
+                page = pdf[page_index]
+                page_width, _ = page.get_size()
+                bitmap = page.render(scale=width/page_width, grayscale=grayscale, rev_byteorder=True)
+                image = bitmap.to_numpy().copy()
+                page.close()
+            finally:
+                pdf.close()
+    else:
+        pages = convert_from_path(pdf_path, dpi=FALLBACK_DPI, first_page=page_index+1, last_page=page_index+1,
+                                  size=(width, None), grayscale=grayscale)
+        image = np.array(pages[0])
+
+    if image.ndim == 3 and grayscale:
+        image = image[:, :, 0]
+    # pdfium truncates the scaled size, make sure the width is exact
+    if image.shape[1] != width:
+        image = imutils.resize(image, width=width)
+    return image
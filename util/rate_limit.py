@@ -0,0 +1,205 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import asyncio
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# globals
+# requests per second allowed by the subscription, per endpoint (analyze and result polls are throttled separately)
+DEFAULT_RATES = {
+    'vision': float(os.environ.get("VISION_TPS", 10)),
+    'formrec': float(os.environ.get("FORMREC_TPS", 15)),
+    'formrec_poll': float(os.environ.get("FORMREC_POLL_TPS", 50))
+}
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("HTTP_POOL_SIZE", 10))
+# wait after a 429 without Retry-After
+DEFAULT_THROTTLE_DELAY = 1.0
+# AIMD: the concurrency limit is cut by this factor on a 429 and grows by one per limit successful calls
+DECREASE_FACTOR = 0.5
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# -----------------------------
+#   CLASSES
+# -----------------------------
+
+class RateLimiter:
+    """
+    Client-side limiter of the calls to one endpoint: a token bucket for the request rate and an AIMD limit on the
+    requests in flight.
+
+    The bucket refills at rate tokens per second up to burst tokens, and each request takes one. The concurrency
+    limit grows by one after limit consecutive successful calls and is halved on every 429; requests that got no
+    response (connection errors, timeouts) leave it unchanged. Callers waiting for a free slot are woken by the
+    release of a request. A 429 also pauses the
+    endpoint for the Retry-After the service sent, so the other callers do not keep hitting it in the meantime.
+
+    Stats: requests sent, throttled (429 responses), throttle_wait (seconds callers spent paused by 429s) and
+    queue_wait (seconds callers spent waiting for a token or a free slot).
+    """
+
+    def __init__(self, name, rate, burst=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, min_concurrency=1):
+        self.name = name
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(max_concurrency)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.throttle_wait = 0.0
+        self.queue_wait = 0.0
+        self._lock = threading.Lock()
+        # notified on every release, for the threads waiting for a slot; event loops waiting get their future set
+        self._released = threading.Condition(self._lock)
+        self._async_waiters = []
+
+    def _try_acquire(self):
+        # called with the lock held: returns 0 when a token and a slot were taken, otherwise how long to wait (None
+        # until the next release when every slot is taken) and whether it is a 429 pause
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now, True
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.in_flight >= int(self.concurrency):
+            return None, False
+        if self.tokens < 1.0:
+            return (1.0 - self.tokens) / self.rate, False
+        self.tokens -= 1.0
+        self.in_flight += 1
+        self.requests += 1
+        return 0.0, False
+
+    def _waited(self, seconds, throttled):
+        # called with the lock held
+        if throttled:
+            self.throttle_wait += seconds
+        else:
+            self.queue_wait += seconds
+
+    def acquire(self):
+        """
+        Blocks until the request can be sent. Every acquire must be followed by a release.
+        """
+        with self._released:
+            while True:
+                wait, throttled = self._try_acquire()
+                if wait == 0.0:
+                    return
+                started = time.monotonic()
+                self._released.wait(wait)
+                self._waited(time.monotonic() - started, throttled)
+
+    async def acquire_async(self):
+        """
+        Same as acquire, without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                wait, throttled = self._try_acquire()
+                if wait == 0.0:
+                    return
+                if wait is None:
+                    released = loop.create_future()
+                    self._async_waiters.append((loop, released))
+            started = time.monotonic()
+            if wait is None:
+                await released
+            else:
+                await asyncio.sleep(wait)
+            with self._lock:
+                self._waited(time.monotonic() - started, throttled)
+
+    def release(self, status, headers=None):
+        """
+        Records the outcome of a request: a 429 pauses the endpoint for its Retry-After and decreases the concurrency
+        limit, any other status increases it. status is None when no response came back, which changes neither.
+
+        Returns:
+        bool: True when the request was throttled and should be sent again.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self._released.notify_all()
+            for loop, released in self._async_waiters:
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(_wake, released)
+            self._async_waiters.clear()
+            if status is None:
+                return False
+            if status != 429:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+                return False
+            self.throttled += 1
+            self.concurrency = max(self.min_concurrency, self.concurrency * DECREASE_FACTOR)
+            self.paused_until = max(self.paused_until, time.monotonic() + get_retry_after(headers or {}, DEFAULT_THROTTLE_DELAY))
+            # no burst right after the pause
+            self.tokens = 0.0
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'throttle_wait': round(self.throttle_wait, 3),
+                'queue_wait': round(self.queue_wait, 3),
+                'concurrency': int(self.concurrency)
+            }
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+def get_retry_after(headers, default):
+    """
+    Returns the number of seconds the service asked us to wait (Retry-After header), or the default when not present.
+    """
+    try:
+        return max(float(headers.get("Retry-After")), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+def configure_rate_limits(rates=None, max_concurrency=None):
+    """
+    Replaces the limiters: rates maps endpoint names ('vision', 'formrec', 'formrec_poll') to requests per second,
+    endpoints not in it keep their default rate.
+    """
+    with _limiters_lock:
+        _limiters.clear()
+        for name, rate in {**DEFAULT_RATES, **(rates or {})}.items():
+            _limiters[name] = RateLimiter(name, rate, max_concurrency=max_concurrency or DEFAULT_MAX_CONCURRENCY)
+
+def get_limiter(name):
+    """
+    Returns the process wide limiter of an endpoint, created with the default rate on first use.
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name, DEFAULT_RATES.get(name, DEFAULT_RATES['formrec']))
+        return _limiters[name]
+
+def get_throttling_stats():
+    """
+    Returns the stats of every limiter used so far, by endpoint name.
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
@@ -0,0 +1,118 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import os
+import random
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# globals
+# statuses worth another attempt (429 is retried by the rate limiter, after its Retry-After)
+RETRYABLE_STATUSES = frozenset({408, 500, 502, 503, 504})
+DEFAULT_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", 5))
+DEFAULT_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", 0.5))
+DEFAULT_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", 20))
+DEFAULT_MAX_RETRY_TIME = float(os.environ.get("RETRY_MAX_TIME", 60))
+DEFAULT_CALL_DEADLINE = float(os.environ.get("CALL_DEADLINE", 300))
+
+_policy = None
+
+# -----------------------------
+#   CLASSES
+# -----------------------------
+
+class ServiceError(Exception):
+    """
+    A call to the Vision or Document Intelligence service failed: a fatal status, or a transient failure that was
+    still failing when its retries or its deadline ran out. status is the HTTP status, None for connection errors.
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+class RetryPolicy:
+    """
+    How service calls are retried: at most max_attempts attempts, waiting a random delay between 0 and
+    base_delay * 2^attempt (capped at max_delay) between them ("full jitter"), for at most max_retry_time seconds of
+    waiting in total. Each call, including the polls of an analyze operation, must finish within deadline seconds.
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 max_retry_time=DEFAULT_MAX_RETRY_TIME, deadline=DEFAULT_CALL_DEADLINE):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_time = max_retry_time
+        self.deadline = deadline
+
+    def start(self):
+        """
+        Returns the retry budget of a new call.
+        """
+        return RetryBudget(self)
+
+class RetryBudget:
+    """
+    The retries left to one call of a RetryPolicy, and its deadline.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.attempt = 1
+        self.retry_time = 0.0
+        self.retries = 0
+        self.deadline = time.monotonic() + policy.deadline
+
+    def remaining(self):
+        """
+        Seconds left before the deadline of the call (negative when it passed).
+        """
+        return self.deadline - time.monotonic()
+
+    def timeout(self, connect_timeout, read_timeout):
+        """
+        Returns the (connect, read) timeouts of the next request, shortened so it ends by the deadline.
+
+        Raises:
+        - ServiceError: If the deadline passed.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise ServiceError(f"Deadline of {self.policy.deadline}s exceeded")
+        return min(connect_timeout, remaining), min(read_timeout, remaining)
+
+    def next_delay(self, retry_after=None):
+        """
+        Returns how long to wait before the next attempt (retry_after when the service sent one), or None when the
+        attempts, the retry time or the deadline are exhausted.
+        """
+        if self.attempt >= self.policy.max_attempts:
+            return None
+        delay = retry_after if retry_after is not None else random.uniform(0, min(self.policy.max_delay, self.policy.base_delay * 2**self.attempt))
+        if self.retry_time + delay > self.policy.max_retry_time or delay >= self.remaining():
+            return None
+        self.attempt += 1
+        self.retries += 1
+        self.retry_time += delay
+        return delay
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+def configure_retry(policy):
+    global _policy
+    _policy = policy
+
+def get_retry_policy():
+    """
+    Returns the retry policy of the service clients (RETRY_* and CALL_DEADLINE from the environment by default).
+    """
+    global _policy
+    if _policy is None:
+        _policy = RetryPolicy()
+    return _policy
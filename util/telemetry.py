@@ -0,0 +1,185 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import importlib.util
+import threading
+from contextlib import contextmanager
+
+# globals
+SERVICE_NAME = "claim-preprocessing"
+DEFAULT_METRICS_ADDR = "127.0.0.1"
+# API latency buckets (seconds): detection calls take well under a second, analyze operations several seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_tracer = None
+_tracer_provider = None
+_spans_out = None
+_metrics = None
+_metrics_lock = threading.Lock()
+
+# -----------------------------
+#   CLASSES
+# -----------------------------
+
+class Metrics:
+    """
+    The Prometheus metrics of the pipeline, in a registry of their own.
+
+    - forms_processed_total{status}: forms that got their record, status 'ok' or 'error'.
+    - forms_in_flight: forms in the batches being processed (the depth of the work queue).
+    - stage_duration_seconds{stage}: time spent by a form in each stage (see util.timing).
+    - api_requests_total{endpoint, status} and api_request_duration_seconds{endpoint}: every request sent to the
+      services, retries and polls included; status is the HTTP status or 'error' when no response came back.
+    - api_retries_total{endpoint, reason}: requests sent again, reason 'throttled' (429) or 'failed'.
+    - cache_requests_total{kind, result}: result cache lookups, result 'hit' or 'miss'.
+    """
+
+    def __init__(self):
+        import prometheus_client as prometheus
+
+        self.registry = prometheus.CollectorRegistry()
+        self.forms = prometheus.Counter('forms_processed', 'Forms that got their record', ['status'], registry=self.registry)
+        self.forms_in_flight = prometheus.Gauge('forms_in_flight', 'Forms in the batches being processed', registry=self.registry)
+        self.stage_duration = prometheus.Histogram('stage_duration_seconds', 'Time spent by a form in a stage', ['stage'],
+                                                   buckets=STAGE_BUCKETS, registry=self.registry)
+        self.requests = prometheus.Counter('api_requests', 'Requests sent to the services', ['endpoint', 'status'], registry=self.registry)
+        self.request_duration = prometheus.Histogram('api_request_duration_seconds', 'Latency of the requests sent to the services',
+                                                     ['endpoint'], buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.retries = prometheus.Counter('api_retries', 'Requests sent again', ['endpoint', 'reason'], registry=self.registry)
+        self.cache = prometheus.Counter('cache_requests', 'Result cache lookups', ['kind', 'result'], registry=self.registry)
+        self.server = None
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+### Tracing
+
+def configure_tracing(spans_file=None, otlp_endpoint=None):
+    """
+    Enables the tracing spans, exported as JSON lines to spans_file and/or to an OpenTelemetry collector
+    (OTLP over HTTP, e.g. http://localhost:4318/v1/traces).
+
+    Spans are created around object detection and document analysis calls (with a child span per poll), around each
+    batch and each post-processing module. Without configure_tracing they cost nothing.
+
+    Raises:
+    - ValueError: If opentelemetry-sdk (or opentelemetry-exporter-otlp for a collector) is not installed.
+    """
+    global _tracer, _tracer_provider, _spans_out
+    if importlib.util.find_spec('opentelemetry.sdk') is None:
+        raise ValueError("Tracing requires opentelemetry-sdk (pip install opentelemetry-sdk)")
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    if otlp_endpoint and importlib.util.find_spec('opentelemetry.exporter.otlp.proto.http') is None:
+        raise ValueError("Exporting spans to a collector requires opentelemetry-exporter-otlp (pip install opentelemetry-exporter-otlp)")
+
+    shutdown_tracing()
+    provider = TracerProvider(resource=Resource.create({'service.name': SERVICE_NAME}))
+    if spans_file:
+        _spans_out = open(spans_file, "a")
+        provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter(out=_spans_out, formatter=lambda span: span.to_json(indent=None) + "\n")))
+    if otlp_endpoint:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=otlp_endpoint)))
+    _tracer_provider = provider
+    _tracer = provider.get_tracer(SERVICE_NAME)
+
+def shutdown_tracing():
+    """
+    Exports the pending spans, closes the spans file and disables tracing.
+    """
+    global _tracer, _tracer_provider, _spans_out
+    if _tracer_provider is not None:
+        _tracer_provider.shutdown()
+    if _spans_out is not None:
+        _spans_out.close()
+    _tracer = None
+    _tracer_provider = None
+    _spans_out = None
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Runs the block in a span, child of the current span of the thread. Yields the span, None when tracing is off.
+    Exceptions raised in the block are recorded on the span.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+### Metrics
+
+def configure_metrics(port=None, addr=DEFAULT_METRICS_ADDR):
+    """
+    Enables the metrics (see Metrics) and, when a port is given, serves them at http://addr:port/metrics.
+
+    Raises:
+    - ValueError: If prometheus_client is not installed.
+    """
+    global _metrics
+    if importlib.util.find_spec('prometheus_client') is None:
+        raise ValueError("Metrics require prometheus_client (pip install prometheus_client)")
+    import prometheus_client as prometheus
+
+    with _metrics_lock:
+        if _metrics is not None and _metrics.server is not None:
+            _metrics.server.shutdown()
+            _metrics.server.server_close()
+        metrics = Metrics()
+        if port is not None:
+            metrics.server, _ = prometheus.start_http_server(port, addr, registry=metrics.registry)
+        _metrics = metrics
+
+def get_metrics():
+    """
+    Returns the enabled metrics, None when configure_metrics was not called.
+    """
+    return _metrics
+
+def write_metrics(path):
+    """
+    Writes the current metrics to a file in the Prometheus text format (for the node exporter textfile collector).
+    """
+    import prometheus_client as prometheus
+
+    if _metrics is not None:
+        prometheus.write_to_textfile(path, _metrics.registry)
+
+def observe_request(endpoint, status, seconds):
+    metrics = _metrics
+    if metrics is not None and endpoint is not None:
+        metrics.requests.labels(endpoint, str(status) if status is not None else 'error').inc()
+        metrics.request_duration.labels(endpoint).observe(seconds)
+
+def count_retry(endpoint, reason):
+    metrics = _metrics
+    if metrics is not None:
+        metrics.retries.labels(endpoint, reason).inc()
+
+def count_cache(kind, hit):
+    metrics = _metrics
+    if metrics is not None:
+        metrics.cache.labels(kind, 'hit' if hit else 'miss').inc()
+
+def add_forms_in_flight(count):
+    metrics = _metrics
+    if metrics is not None:
+        metrics.forms_in_flight.inc(count)
+
+def observe_form(durations, error=None):
+    """
+    Counts a form that got its record and observes the time it spent in each stage (seconds, by stage name).
+    """
+    metrics = _metrics
+    if metrics is not None:
+        metrics.forms.labels('error' if error else 'ok').inc()
+        for stage, seconds in durations.items():
+            metrics.stage_duration.labels(stage).observe(seconds)
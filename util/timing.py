@@ -0,0 +1,162 @@
+# -----------------------------
+#   IMPORTS
+# -----------------------------
+# Import the necessary packages
+import json
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+# globals
+# report order of the stages, stages timed elsewhere are reported after these
+STAGES = ('rasterize', 'encode', 'detection', 'crop', 'denoise', 'payload', 'analyze_post', 'analyze_poll', 'postprocess')
+PERCENTILES = (50, 95, 99)
+
+_local = threading.local()
+_timer = None
+
+# -----------------------------
+#   CLASSES
+# -----------------------------
+
+class StageTimes(dict):
+    """
+    Seconds spent in each stage, by stage name, with the CPU time used by the timed thread in each stage in cpu.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cpu = {}
+
+class StageTimer:
+    """
+    Collects the time each form of a run spent in each stage and summarizes it at the end of the run.
+
+    Stages run for a whole batch (detection, payload assembly, document analysis) count their full duration for every
+    form of the batch: it is the latency the form waited for, not its share of the cost. Their CPU time, on the
+    contrary, is shared between the forms of the batch, so the CPU totals of the stages add up to the CPU the run
+    used. When a trace file is given, the stage times of each form are also written to it as one JSON line per form.
+    """
+
+    def __init__(self, trace_file=None):
+        self.started = time.monotonic()
+        self.forms = 0
+        self.samples = {}
+        self.cpu = {}
+        self.trace = open(trace_file, "a") if trace_file else None
+        self._lock = threading.Lock()
+
+    def record(self, form_file, page_index, durations, error=None):
+        """
+        Records the stage durations (seconds, by stage name, see StageTimes) of a form.
+        """
+        cpu = getattr(durations, 'cpu', {})
+        with self._lock:
+            self.forms += 1
+            for stage, seconds in durations.items():
+                self.samples.setdefault(stage, []).append(seconds)
+            for stage, seconds in cpu.items():
+                self.cpu[stage] = self.cpu.get(stage, 0.0) + seconds
+            if self.trace is not None:
+                line = {'file': form_file, 'page': page_index+1, 'stages': {stage: round(seconds, 6) for stage, seconds in durations.items()},
+                        'cpu': {stage: round(seconds, 6) for stage, seconds in cpu.items()}}
+                if error:
+                    line['error'] = error
+                self.trace.write(json.dumps(line) + "\n")
+
+    def summary(self, api_calls=None):
+        """
+        Returns the report of the run: forms per minute, API calls per form (api_calls maps endpoint names to the
+        number of requests sent during the run) and, for each stage, the number of forms, total time, CPU time and
+        percentiles.
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            stages = {}
+            for stage in sorted(self.samples, key=lambda stage: (STAGES.index(stage) if stage in STAGES else len(STAGES), stage)):
+                samples = np.array(self.samples[stage])
+                stages[stage] = {'count': len(samples), 'total': round(float(samples.sum()), 3), 'cpu': round(self.cpu.get(stage, 0.0), 3)}
+                for percentile, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+                    stages[stage][f"p{percentile}"] = round(float(value), 4)
+            forms = self.forms
+        return {
+            'forms': forms,
+            'elapsed': round(elapsed, 3),
+            'forms_per_minute': round(forms / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            'api_calls_per_form': {endpoint: round(calls / forms, 2) if forms > 0 else 0.0 for endpoint, calls in (api_calls or {}).items()},
+            'stages': stages
+        }
+
+    def close(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+# -----------------------------
+#   FUNCTIONS
+# -----------------------------
+
+@contextmanager
+def timed(stage):
+    """
+    Adds the time spent in the block to the stage in the durations being collected by the current thread (see
+    collect), does nothing when none are.
+    """
+    start = time.perf_counter()
+    start_cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        durations = getattr(_local, 'durations', None)
+        if durations is not None:
+            durations[stage] = durations.get(stage, 0.0) + time.perf_counter() - start
+            durations.cpu[stage] = durations.cpu.get(stage, 0.0) + time.thread_time() - start_cpu
+
+@contextmanager
+def collect():
+    """
+    Collects the stage durations timed by the current thread inside the block, in the StageTimes it yields.
+    """
+    previous = getattr(_local, 'durations', None)
+    durations = StageTimes()
+    _local.durations = durations
+    try:
+        yield durations
+    finally:
+        _local.durations = previous
+
+def measure(fn, *args):
+    """
+    Calls fn and returns its result with the stage durations timed inside it. Used to run stages in a process pool,
+    whose workers cannot record in the timer of the main process.
+    """
+    with collect() as durations:
+        result = fn(*args)
+    return result, durations
+
+def add_durations(target, durations, cpu_share=1.0):
+    """
+    Adds stage durations (StageTimes) to the ones of a form. cpu_share is the part of their CPU time that goes to
+    the form, 1 / the number of forms for stages run once for a batch.
+    """
+    for stage, seconds in durations.items():
+        target[stage] = target.get(stage, 0.0) + seconds
+    for stage, seconds in durations.cpu.items():
+        target.cpu[stage] = target.cpu.get(stage, 0.0) + seconds * cpu_share
+
+def start_timing(trace_file=None):
+    """
+    Starts the timer of a new run, replacing the previous one, and returns it.
+    """
+    global _timer
+    if _timer is not None:
+        _timer.close()
+    _timer = StageTimer(trace_file)
+    return _timer
+
+def get_timer():
+    """
+    Returns the timer of the current run, None before start_timing.
+    """
+    return _timer